@@ -6,17 +6,19 @@ from functools import wraps
 import os
 import io
 from datetime import datetime, timedelta, timezone
-from models import db, Student, Teacher, Message, Class, TeachingGroup, Assignment, Submission, Module, ModuleResource, ModuleTextbook, StudentModuleMastery, StudentLearningProfile, LearningSession, Interactive
+from models import db, Student, Teacher, Message, Class, TeachingGroup, Assignment, Submission, Module, ModuleResource, ModuleTextbook, StudentModuleMastery, StudentLearningProfile, LearningSession, Interactive, ModuleGenerationCache
 from utils.auth import hash_password, verify_password, validate_password, generate_assignment_id, generate_submission_id, encrypt_api_key, decrypt_api_key
 from utils.ai_marking import get_teacher_ai_service, mark_submission
 from utils.google_drive import get_teacher_drive_manager, upload_assignment_file
 from utils.pdf_generator import generate_feedback_pdf
-from utils.notifications import notify_submission_ready
+from utils.notifications import notify_submission_ready, notify_assignment_published
 from utils.module_ai import (
     generate_modules_from_syllabus,
     assess_student_understanding,
+    condense_chat_history,
     generate_interactive_assessment,
     analyze_writing_submission,
+    syllabus_cache_key,
 )
 from utils import rag_service
 from utils.nanobanana import generate_pro as nanobanana_generate_pro, wait_for_result as nanobanana_wait_for_result
@@ -29,6 +31,7 @@ import json
 import base64
 import subprocess
 import tempfile
+import threading
 import PyPDF2
 
 # Load environment variables
@@ -3554,13 +3557,24 @@ def learning_chat():
                 textbook_context = "\n\n---\n\n".join(
                     c.get('content', '') for c in rag_result['chunks'] if c.get('content')
                 )
+        history_summary = learning_session.get('history_summary') if learning_session else None
+        summarized_upto = learning_session.get('history_summary_upto', 0) if learning_session else 0
+        if learning_session:
+            new_summary, new_upto = condense_chat_history(chat_history, history_summary, summarized_upto)
+            if new_upto != summarized_upto:
+                history_summary, summarized_upto = new_summary, new_upto
+                LearningSession.update_one(
+                    {'session_id': session_id},
+                    {'$set': {'history_summary': history_summary, 'history_summary_upto': summarized_upto}},
+                )
         result = assess_student_understanding(
             student_message=message,
             module=module,
-            chat_history=chat_history,
+            chat_history=chat_history[summarized_upto:],
             student_profile=profile,
             writing_image=writing_bytes,
             textbook_context=textbook_context,
+            history_summary=history_summary,
         )
 
         if 'error' in result and 'response' not in result:
@@ -5255,17 +5269,29 @@ def create_assignment():
             # Send push notifications if assignment is published
             if assignment_doc['status'] == 'published':
                 try:
-                    from utils.push_notifications import send_assignment_notification, is_push_configured
+                    from utils.push_notifications import send_assignment_notification_async, is_push_configured
                     if is_push_configured():
-                        push_result = send_assignment_notification(
+                        send_assignment_notification_async(
                             db=db,
                             assignment=assignment_doc,
                             class_id=target_class_id,
                             teaching_group_id=target_group_id
                         )
-                        logger.info(f"Push notifications sent for assignment {assignment_id}: {push_result}")
+                        logger.info(f"Push notifications queued for assignment {assignment_id}")
                 except Exception as push_error:
                     logger.warning(f"Push notification failed (non-critical): {push_error}")
+                
+                # Telegram message to students who linked the bot, sent off the request thread
+                if assignment_doc.get('notify_student_telegram'):
+                    try:
+                        students = _get_students_for_assignment(assignment_doc, session['teacher_id'])
+                        threading.Thread(
+                            target=notify_assignment_published,
+                            args=(assignment_doc, students, teacher),
+                            daemon=True
+                        ).start()
+                    except Exception as telegram_error:
+                        logger.warning(f"Telegram notification failed (non-critical): {telegram_error}")
             
             return redirect(url_for('teacher_assignments'))
             
@@ -7976,17 +8002,33 @@ def create_module():
             if not api_key:
                 api_key = os.getenv('ANTHROPIC_API_KEY')
 
-            result = generate_modules_from_syllabus(
-                file_content=file_content,
-                file_type=file_type,
-                subject=subject,
-                year_level=year_level,
-                teacher_id=session['teacher_id'],
-                api_key=api_key,
-            )
+            # Same syllabus + subject + year level: reuse the previously generated tree
+            cache_key = syllabus_cache_key(file_content, subject, year_level)
+            cached = ModuleGenerationCache.find_one({'_id': cache_key})
+            if cached and cached.get('tree'):
+                result = cached['tree']
+            else:
+                result = generate_modules_from_syllabus(
+                    file_content=file_content,
+                    file_type=file_type,
+                    subject=subject,
+                    year_level=year_level,
+                    teacher_id=session['teacher_id'],
+                    api_key=api_key,
+                )
+
+                if 'error' in result:
+                    return jsonify({'error': result['error']}), 500
 
-            if 'error' in result:
-                return jsonify({'error': result['error']}), 500
+                if result.get('root'):
+                    try:
+                        ModuleGenerationCache.update_one(
+                            {'_id': cache_key},
+                            {'$set': {'tree': result, 'created_at': datetime.utcnow()}},
+                            upsert=True,
+                        )
+                    except Exception as cache_err:
+                        logger.warning("Could not cache generated module tree: %s", cache_err)
 
             root_node = result.get('root')
             if not root_node:
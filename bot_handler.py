@@ -35,19 +35,14 @@ def send_to_teacher(telegram_id: int, student_name: str, message: str, teacher_i
         logger.error(f"Error sending message to teacher: {e}")
         return False
 
-def send_notification(telegram_id: int, notification_type: str, data: dict):
-    """Send a notification to a teacher via Telegram"""
-    if not bot:
-        logger.error("Bot token not configured")
-        return False
-     
-    try:
-        if notification_type == 'new_submission':
-            web_url = os.getenv('WEB_URL', 'http://localhost:5000')
-            student_display = data.get('student_name', 'Unknown')
-            if data.get('student_class'):
-                student_display = f"{student_display} ({data.get('student_class')})"
-            message = f"""📚 *New Assignment Submission*
+def _format_notification(notification_type: str, data: dict) -> str:
+    """Build the Markdown text for a notification"""
+    if notification_type == 'new_submission':
+        web_url = os.getenv('WEB_URL', 'http://localhost:5000')
+        student_display = data.get('student_name', 'Unknown')
+        if data.get('student_class'):
+            student_display = f"{student_display} ({data.get('student_class')})"
+        return f"""📚 *New Assignment Submission*
 
 👤 Student: {student_display}
 📝 Assignment: {data.get('assignment_title', 'Untitled')}
@@ -55,29 +50,37 @@ def send_notification(telegram_id: int, notification_type: str, data: dict):
 🕐 Submitted: {data.get('submitted_at', 'Just now')}
 
 🔗 [Review Submission]({web_url}/teacher/submissions/{data.get('submission_id', '')}/review)"""
-        
-        elif notification_type == 'new_message':
-            student_display = data.get('student_name', 'Unknown')
-            if data.get('student_class'):
-                student_display = f"{student_display} ({data.get('student_class')})"
-            message = f"""💬 *New Message*
+
+    elif notification_type == 'new_message':
+        student_display = data.get('student_name', 'Unknown')
+        if data.get('student_class'):
+            student_display = f"{student_display} ({data.get('student_class')})"
+        return f"""💬 *New Message*
 
 👤 From: {student_display}
 📝 Message: {data.get('message', '')}"""
-        
-        elif notification_type == 'assignment_reminder':
-            message = f"""⏰ *Assignment Reminder*
+
+    elif notification_type == 'assignment_reminder':
+        return f"""⏰ *Assignment Reminder*
 
 📝 Assignment: {data.get('assignment_title', 'Untitled')}
 📅 Due: {data.get('due_date', 'N/A')}
 📊 Pending submissions: {data.get('pending_count', 0)}"""
 
-        elif notification_type == 'correction_challenge_received':
-            web_url = os.getenv('WEB_URL', 'http://localhost:5000')
-            student_display = data.get('student_name', 'Unknown')
-            if data.get('student_class'):
-                student_display = f"{student_display} ({data.get('student_class')})"
-            message = f"""📩 *Correction/Challenge Received*
+    elif notification_type == 'new_assignment':
+        return f"""📝 *New Assignment*
+
+📝 Assignment: {data.get('assignment_title') or 'Untitled'}
+📖 Subject: {data.get('subject') or 'N/A'}
+👩‍🏫 Teacher: {data.get('teacher_name') or 'Your teacher'}
+📅 Due: {data.get('due_date') or 'No due date'}"""
+
+    elif notification_type == 'correction_challenge_received':
+        web_url = os.getenv('WEB_URL', 'http://localhost:5000')
+        student_display = data.get('student_name', 'Unknown')
+        if data.get('student_class'):
+            student_display = f"{student_display} ({data.get('student_class')})"
+        return f"""📩 *Correction/Challenge Received*
 
 👤 Student: {student_display}
 📝 Assignment: {data.get('assignment_title', 'Untitled')}
@@ -86,9 +89,17 @@ def send_notification(telegram_id: int, notification_type: str, data: dict):
 The student has sent corrections or challenged the feedback.
 
 🔗 [View submission & student response]({web_url}/teacher/submissions/{data.get('submission_id', '')}/review)"""
-        
-        else:
-            message = f"📢 Notification: {notification_type}\n{str(data)}"
+
+    return f"📢 Notification: {notification_type}\n{str(data)}"
+
+def send_notification(telegram_id: int, notification_type: str, data: dict):
+    """Send a notification to a teacher via Telegram"""
+    if not bot:
+        logger.error("Bot token not configured")
+        return False
+     
+    try:
+        message = _format_notification(notification_type, data)
         
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
@@ -107,6 +118,84 @@ The student has sent corrections or challenged the feedback.
         logger.error(f"Error sending notification: {e}")
         return False
 
+# Bulk notifications: Telegram allows ~30 messages/second to different chats, so stay under that
+BULK_SEND_CONCURRENCY = 20
+BULK_SENDS_PER_SECOND = 25
+# Give up on a chat that keeps hitting flood control after this many seconds
+BULK_RETRY_DEADLINE = 300
+
+class _SendPacer:
+    """Spaces sends evenly so a bulk run never exceeds BULK_SENDS_PER_SECOND"""
+
+    def __init__(self, per_second: float):
+        self._interval = 1.0 / per_second
+        self._lock = asyncio.Lock()
+        self._next_slot = 0.0
+
+    async def wait(self):
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            now = loop.time()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self._interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+async def _send_bulk(telegram_ids: list, message: str) -> int:
+    """Send one message to many chats at a paced rate; returns the number delivered"""
+    from telegram.error import RetryAfter
+
+    # Own Bot so the pool has room for concurrent sends (the shared one is sized for single messages)
+    request = HTTPXRequest(connection_pool_size=BULK_SEND_CONCURRENCY, pool_timeout=60.0, connect_timeout=30.0)
+    semaphore = asyncio.Semaphore(BULK_SEND_CONCURRENCY)
+    pacer = _SendPacer(BULK_SENDS_PER_SECOND)
+    deadline = asyncio.get_running_loop().time() + BULK_RETRY_DEADLINE
+
+    async with Bot(token=BOT_TOKEN, request=request) as bulk_bot:
+        async def send_one(chat_id):
+            async with semaphore:
+                while True:
+                    await pacer.wait()
+                    try:
+                        await bulk_bot.send_message(
+                            chat_id=chat_id,
+                            text=message,
+                            parse_mode='Markdown',
+                            disable_web_page_preview=True
+                        )
+                        return True
+                    except RetryAfter as e:
+                        if asyncio.get_running_loop().time() + e.retry_after > deadline:
+                            logger.warning(f"Gave up on notification to {chat_id}: still rate limited")
+                            return False
+                        await asyncio.sleep(e.retry_after)
+                    except Exception as e:
+                        logger.warning(f"Could not send notification to {chat_id}: {e}")
+                        return False
+
+        results = await asyncio.gather(*(send_one(chat_id) for chat_id in telegram_ids))
+    return sum(results)
+
+def send_notifications_bulk(telegram_ids: list, notification_type: str, data: dict) -> int:
+    """Send the same notification to many Telegram users at a paced rate; returns the number delivered"""
+    if not bot:
+        logger.error("Bot token not configured")
+        return 0
+    if not telegram_ids:
+        return 0
+
+    try:
+        message = _format_notification(notification_type, data)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        sent = loop.run_until_complete(_send_bulk(telegram_ids, message))
+        loop.close()
+        logger.info(f"Sent {notification_type} notification to {sent}/{len(telegram_ids)} users")
+        return sent
+    except Exception as e:
+        logger.error(f"Error sending bulk notification: {e}")
+        return 0
+
 def send_reply_to_student(telegram_id: int, teacher_name: str, message: str):
     """Send a reply from teacher to student (if student has Telegram linked)"""
     if not bot:
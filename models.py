@@ -88,6 +88,8 @@ class Database:
         self.db.interactives_access.create_index('config_id', unique=True)
         # Assessments access (admin: which teachers/classes/teaching groups can create and use Assessments)
         self.db.assessments_access.create_index('config_id', unique=True)
+        # Cached syllabus -> module tree results (expire after 30 days)
+        self.db.module_generation_cache.create_index('created_at', expireAfterSeconds=30 * 24 * 3600)
 
 db = Database()
 
@@ -394,6 +396,17 @@ class ModuleTextbook:
         return db.db.module_textbooks.delete_one(query)
 
 
+class ModuleGenerationCache:
+    """Cached AI module trees keyed by syllabus content hash, subject, year level and prompt version."""
+    @staticmethod
+    def find_one(query):
+        return db.db.module_generation_cache.find_one(query)
+
+    @staticmethod
+    def update_one(query, update, upsert=False):
+        return db.db.module_generation_cache.update_one(query, update, upsert=upsert)
+
+
 class LearningSession:
     """Records each learning session: chat history, assessments, time spent."""
     @staticmethod
@@ -39,6 +39,7 @@ from utils.notifications import (
 from utils.push_notifications import (
     send_push_notification,
     send_assignment_notification,
+    send_assignment_notification_async,
     send_feedback_notification,
     send_message_notification,
     get_vapid_public_key,
@@ -76,6 +77,7 @@ __all__ = [
     # Push Notifications
     'send_push_notification',
     'send_assignment_notification',
+    'send_assignment_notification_async',
     'send_feedback_notification',
     'send_message_notification',
     'get_vapid_public_key',
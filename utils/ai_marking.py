@@ -1,7 +1,7 @@
 import os
 import logging
 import base64
-import json
+import orjson
 import re
 from anthropic import Anthropic
 from utils.auth import decrypt_api_key
@@ -625,12 +625,13 @@ def parse_ai_response(response_text: str) -> dict:
         text = re.sub(r'^```(?:json)?\s*', '', text)
         text = re.sub(r'\s*```\s*$', '', text)
     try:
-        json_match = re.search(r'\{[\s\S]*\}', text)
-        if json_match:
-            json_str = json_match.group()
-            return json.loads(json_str)
+        # Outermost braces via find/rfind: same span as a greedy regex without the backtracking
+        start = text.find('{')
+        end = text.rfind('}')
+        if start >= 0 and end > start:
+            return orjson.loads(text[start:end + 1])
         return {'error': 'Could not parse response', 'raw': response_text}
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         # Likely truncated when assignment is large (model hit max_tokens)
         truncated_hint = (
             ' Response may have been cut off; this assignment might have too many questions or long feedback. '
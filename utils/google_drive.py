@@ -1,5 +1,11 @@
 import os
+import functools
 import logging
+import mimetypes
+import random
+import threading
+import time
+from cachetools import TTLCache
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
@@ -13,6 +19,128 @@ SCOPES = [
     'https://www.googleapis.com/auth/drive.readonly'
 ]
 
+# Uploads below this size go as a single multipart request (no resumable session round-trip)
+SIMPLE_UPLOAD_MAX_BYTES = 5 * 1024 * 1024
+# Chunk size for resumable uploads of larger payloads (default 100 KB chunks are very slow)
+RESUMABLE_CHUNK_SIZE = 8 * 1024 * 1024
+# Download chunk size: most files arrive in a single ranged GET instead of 100 KB pieces
+DOWNLOAD_CHUNK_SIZE = 10 * 1024 * 1024
+
+# Folder listings / file metadata are cached briefly; DriveManager is created per request,
+# so the caches are shared across instances.
+DRIVE_CACHE_TTL = float(os.getenv('DRIVE_CACHE_TTL', '30'))
+DRIVE_CACHE_MAXSIZE = 1024
+
+# Transient Drive errors (rate limit / server side) are retried with exponential backoff
+DRIVE_RETRY_STATUSES = {429, 500, 502, 503, 504}
+# 403 reasons Drive uses for rate limiting (the request was rejected, nothing was written)
+DRIVE_RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+DRIVE_MAX_RETRIES = 5
+# Drive allows ~10 write requests/s per user; pace writes just under that instead of bursting and retrying
+DRIVE_WRITES_PER_SECOND = float(os.getenv('DRIVE_WRITES_PER_SECOND', '9'))
+
+# Common upload extensions; anything else falls back to mimetypes.guess_type
+_EXT_MIME = {
+    '.pdf': 'application/pdf',
+    '.txt': 'text/plain',
+    '.json': 'application/json',
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+}
+
+
+def _http_status(e: HttpError):
+    return e.resp.status if e.resp is not None else None
+
+
+def _is_rate_limited(e: HttpError) -> bool:
+    """True when Drive rejected the request for rate limiting (safe to resend even for writes)"""
+    status = _http_status(e)
+    if status == 429:
+        return True
+    if status != 403:
+        return False
+    reasons = {d.get('reason') for d in (getattr(e, 'error_details', None) or []) if isinstance(d, dict)}
+    if reasons & DRIVE_RATE_LIMIT_REASONS:
+        return True
+    content = e.content.decode('utf-8', 'replace') if isinstance(e.content, bytes) else str(e.content or '')
+    return any(reason in content for reason in DRIVE_RATE_LIMIT_REASONS)
+
+
+def _is_transient(e: HttpError) -> bool:
+    """True for rate limits and 5xx responses (only safe to resend for idempotent requests)"""
+    return _http_status(e) in DRIVE_RETRY_STATUSES or _is_rate_limited(e)
+
+
+def _retry_drive(should_retry=_is_transient):
+    """Retry a Drive API call with exponential backoff and jitter, honoring Retry-After
+    
+    should_retry decides which HttpErrors are resent. Non-idempotent writes (files.create) use
+    _is_rate_limited: after a 5xx the write may already have happened, so it is not repeated.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(DRIVE_MAX_RETRIES + 1):
+                try:
+                    return func(*args, **kwargs)
+                except HttpError as e:
+                    if not should_retry(e) or attempt == DRIVE_MAX_RETRIES:
+                        raise
+                    retry_after = e.resp.get('retry-after') if e.resp is not None else None
+                    try:
+                        delay = min(60, float(retry_after))
+                    except (TypeError, ValueError):
+                        delay = min(60, 2 ** attempt + random.random())
+                    logger.warning(f"Drive API returned {_http_status(e)}, retrying in {delay:.1f}s (attempt {attempt + 1}/{DRIVE_MAX_RETRIES})")
+                    time.sleep(delay)
+        return wrapper
+    return decorator
+
+
+class _WriteRateLimiter:
+    """Process-wide pacer that spaces Drive write requests evenly (thread-safe)"""
+    
+    def __init__(self, max_per_second: float):
+        self._interval = 1.0 / max_per_second
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+    
+    def acquire(self):
+        """Block until the next write slot is available"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+_write_limiter = _WriteRateLimiter(DRIVE_WRITES_PER_SECOND)
+
+
+@_retry_drive()
+def _execute(request):
+    """Execute a Drive API request with retries"""
+    return request.execute()
+
+
+@_retry_drive(_is_rate_limited)
+def _execute_write(request):
+    """Execute a write-side Drive API request (create/delete), paced by the write limiter.
+    Only rate-limit rejections are retried, so a create that failed with 5xx is never duplicated."""
+    _write_limiter.acquire()
+    return request.execute()
+
+
+@_retry_drive()
+def _next_chunk(downloader):
+    """Fetch the next download chunk with retries"""
+    return downloader.next_chunk()
+
 
 def get_service_account_email() -> str:
     """
@@ -94,10 +222,49 @@ def get_teacher_drive_manager(teacher):
     return DriveManager(service, folder_id)
 
 class DriveManager:
+    # (folder_id, mime_types) -> list of file dicts
+    _list_cache = TTLCache(maxsize=DRIVE_CACHE_MAXSIZE, ttl=DRIVE_CACHE_TTL)
+    # (file_id, fields) -> metadata dict
+    _meta_cache = TTLCache(maxsize=DRIVE_CACHE_MAXSIZE, ttl=DRIVE_CACHE_TTL)
+    _cache_lock = threading.Lock()
+
     def __init__(self, service, folder_id=None):
         self.service = service
         self.folder_id = folder_id
     
+    def _get_metadata(self, file_id: str, fields: str = None) -> dict:
+        """Get file metadata, served from the short-lived cache when possible"""
+        key = (file_id, fields)
+        with self._cache_lock:
+            cached = self._meta_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        kwargs = {'fileId': file_id, 'supportsAllDrives': True}
+        if fields:
+            kwargs['fields'] = fields
+        metadata = _execute(self.service.files().get(**kwargs))
+        with self._cache_lock:
+            self._meta_cache[key] = metadata
+        return metadata
+    
+    def _invalidate_folder(self, folder_id: str):
+        """Drop cached listings for a folder after its contents change"""
+        if not folder_id:
+            return
+        with self._cache_lock:
+            for key in [k for k in self._list_cache.keys() if k[0] == folder_id]:
+                self._list_cache.pop(key, None)
+    
+    def _invalidate_file(self, file_id: str):
+        """Drop cached metadata for a file and any cached listing that contains it"""
+        with self._cache_lock:
+            for key in [k for k in self._meta_cache.keys() if k[0] == file_id]:
+                self._meta_cache.pop(key, None)
+            for key, files in list(self._list_cache.items()):
+                if any(f.get('id') == file_id for f in files):
+                    self._list_cache.pop(key, None)
+    
     def create_folder(self, name: str, parent_id: str = None) -> str:
         """Create a folder in Drive"""
         try:
@@ -108,12 +275,13 @@ class DriveManager:
             if parent_id or self.folder_id:
                 file_metadata['parents'] = [parent_id or self.folder_id]
             
-            file = self.service.files().create(
+            file = _execute_write(self.service.files().create(
                 body=file_metadata,
                 fields='id',
                 supportsAllDrives=True
-            ).execute()
+            ))
             
+            self._invalidate_folder(parent_id or self.folder_id)
             return file.get('id')
         except HttpError as e:
             if e.resp.status == 403 and ('storageQuotaExceeded' in str(e) or 'Service Accounts do not have storage quota' in str(e)):
@@ -140,22 +308,24 @@ class DriveManager:
                 file_metadata['parents'] = [folder_id or self.folder_id]
             
             # Determine mime type
-            mime_type = 'application/octet-stream'
-            if file_path.endswith('.pdf'):
-                mime_type = 'application/pdf'
-            elif file_path.endswith('.txt'):
-                mime_type = 'text/plain'
-            elif file_path.endswith('.json'):
-                mime_type = 'application/json'
+            mime_type = (
+                _EXT_MIME.get(os.path.splitext(file_path)[1].lower())
+                or mimetypes.guess_type(file_path)[0]
+                or 'application/octet-stream'
+            )
             
-            media = MediaFileUpload(file_path, mimetype=mime_type)
-            file = self.service.files().create(
+            if os.path.getsize(file_path) < SIMPLE_UPLOAD_MAX_BYTES:
+                media = MediaFileUpload(file_path, mimetype=mime_type, chunksize=-1, resumable=False)
+            else:
+                media = MediaFileUpload(file_path, mimetype=mime_type, chunksize=RESUMABLE_CHUNK_SIZE, resumable=True)
+            file = _execute_write(self.service.files().create(
                 body=file_metadata,
                 media_body=media,
                 fields='id, webViewLink',
                 supportsAllDrives=True
-            ).execute()
+            ))
             
+            self._invalidate_folder(folder_id or self.folder_id)
             return {
                 'id': file.get('id'),
                 'link': file.get('webViewLink')
@@ -181,19 +351,29 @@ class DriveManager:
             if folder_id or self.folder_id:
                 file_metadata['parents'] = [folder_id or self.folder_id]
             
-            media = MediaIoBaseUpload(
-                io.BytesIO(content),
-                mimetype=mime_type,
-                resumable=True
-            )
+            # Small files: one multipart POST. Large files: resumable upload in 8 MB chunks.
+            if len(content) < SIMPLE_UPLOAD_MAX_BYTES:
+                media = MediaIoBaseUpload(
+                    io.BytesIO(content),
+                    mimetype=mime_type,
+                    resumable=False
+                )
+            else:
+                media = MediaIoBaseUpload(
+                    io.BytesIO(content),
+                    mimetype=mime_type,
+                    chunksize=RESUMABLE_CHUNK_SIZE,
+                    resumable=True
+                )
             
-            file = self.service.files().create(
+            file = _execute_write(self.service.files().create(
                 body=file_metadata,
                 media_body=media,
                 fields='id, webViewLink',
                 supportsAllDrives=True
-            ).execute()
+            ))
             
+            self._invalidate_folder(folder_id or self.folder_id)
             return {
                 'id': file.get('id'),
                 'link': file.get('webViewLink')
@@ -215,7 +395,8 @@ class DriveManager:
     def delete_file(self, file_id: str) -> bool:
         """Delete a file from Drive"""
         try:
-            self.service.files().delete(fileId=file_id).execute()
+            _execute_write(self.service.files().delete(fileId=file_id))
+            self._invalidate_file(file_id)
             return True
         except Exception as e:
             logger.error(f"Error deleting file: {e}")
@@ -229,12 +410,16 @@ class DriveManager:
                 logger.error("No folder ID provided for list_files")
                 return []
             
+            cache_key = (target_folder_id, tuple(mime_types) if mime_types else None)
+            with self._cache_lock:
+                cached = self._list_cache.get(cache_key)
+            if cached is not None:
+                logger.debug(f"Using cached listing for folder {target_folder_id}")
+                return list(cached)
+            
             # First verify the folder exists and we can access it
             try:
-                folder_info = self.service.files().get(
-                    fileId=target_folder_id,
-                    fields="id, name, mimeType"
-                ).execute()
+                folder_info = self._get_metadata(target_folder_id, fields="id, name, mimeType")
                 logger.info(f"Accessing folder: {folder_info.get('name')} (ID: {target_folder_id})")
             except Exception as folder_error:
                 logger.error(f"Cannot access folder {target_folder_id}: {folder_error}")
@@ -250,18 +435,28 @@ class DriveManager:
             logger.debug(f"Querying Google Drive with: {query}")
             
             # Use supportsAllDrives and includeItemsFromAllDrives for Shared Drives compatibility
-            results = self.service.files().list(
+            files_api = self.service.files()
+            list_request = files_api.list(
                 q=query,
-                fields="files(id, name, mimeType, size, modifiedTime)",
+                fields="nextPageToken, files(id, name, mimeType, size, modifiedTime)",
                 orderBy="name",
-                pageSize=100,
+                pageSize=1000,
+                spaces='drive',
                 supportsAllDrives=True,
                 includeItemsFromAllDrives=True
-            ).execute()
+            )
+            
+            # Follow nextPageToken so large folders are not cut off after the first page
+            files = []
+            while list_request is not None:
+                results = _execute(list_request)
+                files.extend(results.get('files', []))
+                list_request = files_api.list_next(list_request, results)
             
-            files = results.get('files', [])
             logger.info(f"Found {len(files)} files matching query in folder {target_folder_id}")
-            return files
+            with self._cache_lock:
+                self._list_cache[cache_key] = files
+            return list(files)
         except Exception as e:
             logger.error(f"Error listing files from folder {folder_id or self.folder_id}: {e}", exc_info=True)
             raise  # Re-raise to let caller handle it
@@ -279,11 +474,11 @@ class DriveManager:
             
             # Try to get folder metadata
             try:
-                folder = self.service.files().get(
+                folder = _execute(self.service.files().get(
                     fileId=target_folder_id,
                     fields="id, name, mimeType, permissions",
                     supportsAllDrives=True
-                ).execute()
+                ))
                 logger.info(f"Successfully accessed folder: {folder.get('name')} (ID: {target_folder_id})")
             except Exception as api_error:
                 error_str = str(api_error)
@@ -315,14 +510,18 @@ class DriveManager:
             logger.error(f"Error verifying folder access: {error_msg}", exc_info=True)
             return False, f"Unexpected error: {error_msg}"
     
-    def get_file_content(self, file_id: str, export_as_pdf: bool = False) -> bytes:
-        """Get file content, optionally exporting Google Docs/Sheets as PDF"""
+    def get_file_content(self, file_id: str, export_as_pdf: bool = False, known_mime: str = None) -> bytes:
+        """Get file content, optionally exporting Google Docs/Sheets as PDF
+        
+        Pass known_mime when the caller already has the file's mimeType (e.g. from list_files)
+        to skip the metadata request.
+        """
         try:
-            file_metadata = self.service.files().get(fileId=file_id).execute()
-            mime_type = file_metadata.get('mimeType', '')
-            
             # If it's a Google Doc/Sheet and we want PDF, export it
             if export_as_pdf:
+                mime_type = known_mime
+                if mime_type is None:
+                    mime_type = self._get_metadata(file_id, fields='mimeType').get('mimeType', '')
                 if mime_type == 'application/vnd.google-apps.document':
                     request = self.service.files().export_media(fileId=file_id, mimeType='application/pdf')
                 elif mime_type == 'application/vnd.google-apps.spreadsheet':
@@ -336,19 +535,18 @@ class DriveManager:
                 # Regular file download
                 request = self.service.files().get_media(fileId=file_id)
             
-            import io
             file_content = io.BytesIO()
-            downloader = MediaIoBaseDownload(file_content, request)
+            downloader = MediaIoBaseDownload(file_content, request, chunksize=DOWNLOAD_CHUNK_SIZE)
             done = False
             while not done:
-                status, done = downloader.next_chunk()
+                status, done = _next_chunk(downloader)
             
-            file_content.seek(0)
-            return file_content.read()
+            return file_content.getvalue()
         except Exception as e:
             logger.error(f"Error getting file content: {e}")
             return None
 
+
 def upload_assignment_file(file_path: str, assignment: dict, teacher: dict) -> dict:
     """
     Upload an assignment-related file to the teacher's Drive folder
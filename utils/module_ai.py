@@ -9,22 +9,140 @@ Uses Anthropic Claude API for:
 import os
 import logging
 import base64
+import hashlib
 import re
-import json
 import io
+import threading
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
+import orjson
+from cachetools import LRUCache
 
 logger = logging.getLogger(__name__)
 
 
+try:
+    import pybase64  # SIMD base64; optional
+except ImportError:
+    pybase64 = None
+
+
+def _b64(data: bytes) -> str:
+    """Base64-encode bytes for the Claude API (pybase64 when installed, else stdlib)."""
+    if pybase64 is not None:
+        return pybase64.b64encode_as_string(data)
+    return base64.b64encode(memoryview(data)).decode('ascii')
+
+
+# Claude downsizes images to this long edge anyway; larger uploads only cost bytes and tokens
+IMAGE_MAX_SIDE = 1568
+
+
+def _prepare_image(raw: bytes, max_side: int = IMAGE_MAX_SIDE) -> bytes:
+    """Downscale and JPEG-recompress an uploaded image for the vision API. Returns raw on failure."""
+    try:
+        from PIL import Image, ImageOps
+        img = Image.open(io.BytesIO(raw))
+        if max(img.size) <= max_side and img.format == 'JPEG':
+            return raw
+        img = ImageOps.exif_transpose(img)  # phone photos carry rotation in EXIF, which is dropped on save
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        buf = io.BytesIO()
+        img.save(buf, 'JPEG', quality=85, optimize=True)
+        return buf.getvalue()
+    except Exception as e:
+        logger.warning("Could not downscale image, sending original: %s", e)
+        return raw
+
+
+def _pdfium_page_text(pdf, page_num: int) -> str:
+    """Extract the text of one page from an open pypdfium2 document."""
+    page = pdf[page_num]
+    textpage = page.get_textpage()
+    try:
+        return textpage.get_text_range()
+    finally:
+        textpage.close()
+        page.close()
+
+
+# Less extracted text than this from a whole PDF means it is scanned images, not text
+PDF_MIN_TEXT_CHARS = 50
+
+
+def _join_page_texts(page_texts: List[str]) -> str:
+    return "\n\n".join(
+        f"--- Page {page_num + 1} ---\n{page_text}"
+        for page_num, page_text in enumerate(page_texts)
+        if page_text
+    )
+
+
+def _extract_pages_poppler(pdf_bytes: bytes) -> Optional[List[str]]:
+    """Page texts via poppler's pdftotext binding, or None if it is not installed or fails."""
+    try:
+        import pdftotext
+    except ImportError:
+        return None
+    try:
+        return list(pdftotext.PDF(io.BytesIO(pdf_bytes)))
+    except Exception as e:
+        logger.warning("pdftotext could not extract PDF text: %s", e)
+        return None
+
+
 def _extract_text_from_pdf(pdf_bytes: bytes) -> str:
+    """Extract text from PDF using poppler (pdftotext) or pypdfium2 (native PDFium), falling back to PyPDF2."""
+    page_texts = _extract_pages_poppler(pdf_bytes)
+    if page_texts is not None:
+        if sum(len(t.strip()) for t in page_texts) < PDF_MIN_TEXT_CHARS:
+            # Image-only PDF: the other extractors would find nothing either
+            logger.info("PDF has no text layer (%d pages); skipping further extraction", len(page_texts))
+            return ""
+        return _join_page_texts(page_texts)
+    try:
+        import pypdfium2
+    except ImportError:
+        return _extract_text_from_pdf_pypdf2(pdf_bytes)
+    try:
+        pdf = pypdfium2.PdfDocument(pdf_bytes)
+        try:
+            page_texts = [_pdfium_page_text(pdf, i) for i in range(len(pdf))]
+        finally:
+            pdf.close()
+        return _join_page_texts(page_texts)
+    except Exception as e:
+        logger.warning("pypdfium2 could not extract PDF text, trying PyPDF2: %s", e)
+        return _extract_text_from_pdf_pypdf2(pdf_bytes)
+
+
+def _page_may_have_text(page) -> bool:
+    """False for pages whose content stream has no text objects (BT) or XObjects (Do) that could hold text.
+
+    PyPDF2 3.x walks every path/fill/colour operator in Python and has no option to skip them,
+    so graphics-only pages (diagrams, scans) are skipped before extract_text instead.
+    """
+    try:
+        contents = page.get_contents()
+        if contents is None:
+            return False
+        data = contents.get_data()
+    except Exception:
+        return True
+    return b"BT" in data or b"Do" in data
+
+
+def _extract_text_from_pdf_pypdf2(pdf_bytes: bytes) -> str:
     """Extract text from PDF using PyPDF2."""
     try:
         import PyPDF2
         pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
         text_parts = []
         for page_num, page in enumerate(pdf_reader.pages):
+            if not _page_may_have_text(page):
+                continue
             page_text = page.extract_text()
             if page_text:
                 text_parts.append(f"--- Page {page_num + 1} ---\n{page_text}")
@@ -34,6 +152,57 @@ def _extract_text_from_pdf(pdf_bytes: bytes) -> str:
         return ""
 
 
+def _find_json_object(text: str) -> str:
+    """Return the first balanced {...} object in text (string-aware), or empty string.
+
+    Single linear pass; used instead of a greedy regex, which backtracks over long responses.
+    """
+    start = text.find("{")
+    if start < 0:
+        return ""
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start : i + 1]
+    return ""
+
+
+def _extract_json(text: str) -> Optional[Dict[str, Any]]:
+    """Parse the first JSON object in an LLM response. Returns None if none found or invalid."""
+    if not text:
+        return None
+    json_str = _find_json_object(text)
+    if json_str:
+        try:
+            result = orjson.loads(json_str)
+            return result if isinstance(result, dict) else None
+        except orjson.JSONDecodeError as je:
+            logger.warning("Could not parse JSON from AI response: %s", je)
+    return None
+
+
+# Trailing commas before } or ]
+_TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+# Control characters except newline/tab/carriage return
+_CTRL_CHARS_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
 def _extract_and_repair_json(text: str) -> str:
     """Extract JSON from LLM response and apply common repairs. Returns empty string if none found."""
     if not text or not text.strip():
@@ -45,25 +214,12 @@ def _extract_and_repair_json(text: str) -> str:
             stripped = stripped[len(marker):].lstrip()
         if stripped.endswith("```"):
             stripped = stripped[:-3].rstrip()
-    # Find first { and extract matching brace
-    start = stripped.find("{")
-    if start < 0:
+    json_str = _find_json_object(stripped)
+    if not json_str:
         return ""
-    depth = 0
-    for i in range(start, len(stripped)):
-        c = stripped[i]
-        if c == "{":
-            depth += 1
-        elif c == "}":
-            depth -= 1
-            if depth == 0:
-                json_str = stripped[start : i + 1]
-                # Remove trailing commas before } or ]
-                json_str = re.sub(r',(\s*[}\]])', r'\1', json_str)
-                # Remove control characters except newline/tab
-                json_str = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f]', '', json_str)
-                return json_str
-    return ""
+    json_str = _TRAILING_COMMA_RE.sub(r'\1', json_str)
+    json_str = _CTRL_CHARS_RE.sub('', json_str)
+    return json_str
 
 # Message shown when no API key is configured (teacher or env)
 AI_UNAVAILABLE_MSG = (
@@ -72,64 +228,9 @@ AI_UNAVAILABLE_MSG = (
 )
 
 
-def get_claude_client(api_key: Optional[str] = None):
-    """Get Anthropic client. Uses api_key if provided, else ANTHROPIC_API_KEY env."""
-    try:
-        from anthropic import Anthropic
-    except ImportError:
-        logger.warning("anthropic package not installed; run: pip install anthropic")
-        return None
-    key = api_key or os.getenv("ANTHROPIC_API_KEY")
-    if not key or not key.strip():
-        return None
-    return Anthropic(api_key=key.strip())
-
-
-def generate_modules_from_syllabus(
-    file_content: bytes,
-    file_type: str,
-    subject: str,
-    year_level: str,
-    teacher_id: str,
-    api_key: Optional[str] = None,
-) -> Dict[str, Any]:
-    """
-    Generate hierarchical module structure from uploaded syllabus/scheme of work.
-
-    Args:
-        file_content: PDF or Word document bytes
-        file_type: 'pdf' or 'docx'
-        subject: Subject name
-        year_level: e.g., "Secondary 3"
-        teacher_id: Owner teacher ID
-        api_key: Optional Anthropic API key (e.g. from teacher settings); else uses ANTHROPIC_API_KEY env.
-
-    Returns:
-        Dictionary with module tree structure
-    """
-    client = get_claude_client(api_key=api_key)
-    if not client:
-        return {"error": AI_UNAVAILABLE_MSG}
-
-    try:
-        content = []
-
-        if file_type == 'pdf':
-            # Extract text from PDF (Claude API doesn't accept PDF as image)
-            pdf_text = _extract_text_from_pdf(file_content)
-            if not pdf_text.strip():
-                return {"error": "Could not extract text from PDF. The PDF may contain only images or be corrupted."}
-            content.append({
-                "type": "text",
-                "text": f"SYLLABUS/SCHEME OF WORK DOCUMENT:\n\n{pdf_text}",
-            })
-        else:
-            content.append({
-                "type": "text",
-                "text": f"[Document content for {subject} - upload PDF for full analysis]",
-            })
-
-        system_prompt = f"""You are an expert curriculum designer. Analyze this syllabus/scheme of work and create a hierarchical module structure for {subject} ({year_level}).
+# Static system prompts. Kept byte-identical across calls so Anthropic prompt caching can
+# reuse them; per-call context (module, subject, profile) goes in a second, uncached block.
+MODULE_GENERATION_PROMPT = """You are an expert curriculum designer. Analyze this syllabus/scheme of work and create a hierarchical module structure for the subject and year level given by the user.
 
 STRUCTURE RULES:
 1. The ROOT module represents the entire year/course
@@ -146,15 +247,15 @@ VISUALIZATION:
 - Use "icon" field with Bootstrap icon names like "bi-calculator", "bi-book"
 
 Respond ONLY with valid JSON in this exact format (no markdown code fence):
-{{
-    "root": {{
+{
+    "root": {
         "title": "Mathematics Year 3",
         "description": "Complete mathematics curriculum for Secondary 3",
         "estimated_hours": 150,
         "color": "#667eea",
         "icon": "bi-diagram-3",
         "children": [
-            {{
+            {
                 "title": "Algebra",
                 "description": "...",
                 "estimated_hours": 40,
@@ -162,7 +263,7 @@ Respond ONLY with valid JSON in this exact format (no markdown code fence):
                 "icon": "bi-calculator",
                 "learning_objectives": ["Understand algebraic expressions", "..."],
                 "children": [
-                    {{
+                    {
                         "title": "Linear Equations",
                         "description": "...",
                         "estimated_hours": 10,
@@ -170,7 +271,7 @@ Respond ONLY with valid JSON in this exact format (no markdown code fence):
                         "icon": "bi-graph-up",
                         "learning_objectives": ["..."],
                         "children": [
-                            {{
+                            {
                                 "title": "Solving One-Variable Equations",
                                 "description": "...",
                                 "estimated_hours": 2,
@@ -178,98 +279,449 @@ Respond ONLY with valid JSON in this exact format (no markdown code fence):
                                 "icon": "bi-book",
                                 "learning_objectives": ["..."],
                                 "is_leaf": true
-                            }}
+                            }
                         ]
-                    }}
+                    }
                 ]
-            }}
+            }
         ]
-    }},
+    },
     "total_modules": 25,
     "total_hours": 150
-}}"""
+}"""
 
-        content.append({
-            "type": "text",
-            "text": f"""
-Subject: {subject}
-Year Level: {year_level}
+TUTOR_PROMPT = """You are an expert, patient tutor helping a student learn. The current module and student context are given in the next block.
 
-Analyze this document and create a comprehensive module hierarchy.
-Ensure all topics from the syllabus are covered.
-Respond with valid JSON only (no markdown, no text outside the JSON). Escape any double quotes inside string values with backslash.""",
-        })
+YOUR ROLE:
+1. TEACH: Explain concepts clearly, use examples, adapt to student's level
+2. ASSESS: Ask questions to check understanding, identify misconceptions
+3. ENCOURAGE: Be supportive, celebrate progress, build confidence
+4. ADAPT: Use the student's learning profile to personalize teaching
 
-        # JSON schema for structured output (guarantees valid JSON from Claude Opus 4.5)
-        module_schema = {
+ASSESSMENT GUIDELINES:
+- After teaching a concept, ask a question to assess understanding
+- If student answers correctly: Award mastery points (mastery_change 1-10), move to next concept
+- If student struggles: Provide hints, break down the problem, try different explanations
+- Note any patterns in mistakes for profile updates
+
+RESPONSE FORMAT - Respond with valid JSON only (no markdown):
+{
+    "response": "Your teaching response to the student (use markdown for formatting, include examples)",
+    "response_type": "teaching",
+    "assessment": {
+        "question_asked": "The assessment question if any",
+        "student_answer_correct": true,
+        "mastery_change": 5,
+        "concept_assessed": "Specific concept tested"
+    },
+    "profile_updates": {
+        "new_strength": null,
+        "new_weakness": null,
+        "new_mistake_pattern": null
+    },
+    "next_action": "continue_teaching",
+    "interactive_element": null
+}
+
+Use "response_type" one of: teaching, assessment, feedback, encouragement.
+Use "mastery_change" between -10 and 10. Use "next_action" one of: continue_teaching, assess_understanding, review_previous, module_complete."""
+
+ASSESSMENT_PROMPT = """Generate an interactive assessment for the learning module described in the next block.
+
+Create 5 questions that test understanding of the learning objectives.
+
+Respond with valid JSON only:
+{
+    "questions": [
+        {
+            "id": 1,
+            "type": "mcq",
+            "question": "...",
+            "options": ["A) ...", "B) ...", "C) ...", "D) ..."],
+            "correct_answer": "B",
+            "explanation": "Why B is correct...",
+            "hints": ["Hint 1", "Hint 2"],
+            "points": 10
+        }
+    ],
+    "total_points": 50,
+    "passing_score": 35,
+    "time_limit_minutes": 15
+}"""
+
+WRITING_ANALYSIS_PROMPT = """Analyze this student's handwritten work for the module described in the next block.
+
+Evaluate:
+1. Mathematical/logical correctness
+2. Clarity of presentation
+3. Method and approach used
+4. Any errors or misconceptions
+
+Respond with valid JSON only:
+{
+    "transcription": "Text version of what's written",
+    "analysis": "Detailed analysis of the work",
+    "is_correct": true,
+    "errors": [],
+    "suggestions": [],
+    "mastery_indication": 75
+}
+
+Use is_correct: true, false, or "partial". mastery_indication is 0-100."""
+
+
+# JSON schema for structured module-generation output (guarantees valid JSON from Claude Opus 4.5).
+# Built once at import; never mutated.
+_MODULE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "root": {
             "type": "object",
             "properties": {
-                "root": {
-                    "type": "object",
-                    "properties": {
-                        "title": {"type": "string"},
-                        "description": {"type": "string"},
-                        "estimated_hours": {"type": "number"},
-                        "color": {"type": "string"},
-                        "icon": {"type": "string"},
-                        "learning_objectives": {"type": "array", "items": {"type": "string"}},
-                        "children": {"type": "array", "items": {"$ref": "#/$defs/module"}},
-                        "is_leaf": {"type": "boolean"},
-                    },
-                    "required": ["title"],
-                    "additionalProperties": False,
-                },
-                "total_modules": {"type": "integer"},
-                "total_hours": {"type": "number"},
+                "title": {"type": "string"},
+                "description": {"type": "string"},
+                "estimated_hours": {"type": "number"},
+                "color": {"type": "string"},
+                "icon": {"type": "string"},
+                "learning_objectives": {"type": "array", "items": {"type": "string"}},
+                "children": {"type": "array", "items": {"$ref": "#/$defs/module"}},
+                "is_leaf": {"type": "boolean"},
             },
-            "required": ["root"],
+            "required": ["title"],
             "additionalProperties": False,
-            "$defs": {
-                "module": {
+        },
+        "total_modules": {"type": "integer"},
+        "total_hours": {"type": "number"},
+    },
+    "required": ["root"],
+    "additionalProperties": False,
+    "$defs": {
+        "module": {
+            "type": "object",
+            "properties": {
+                "title": {"type": "string"},
+                "description": {"type": "string"},
+                "estimated_hours": {"type": "number"},
+                "color": {"type": "string"},
+                "icon": {"type": "string"},
+                "learning_objectives": {"type": "array", "items": {"type": "string"}},
+                "children": {"type": "array", "items": {"$ref": "#/$defs/module"}},
+                "is_leaf": {"type": "boolean"},
+            },
+            "required": ["title"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+# Tool schemas used to get structured output via forced tool use instead of prose JSON instructions.
+# Claude 4 models emit tool calls token-efficiently without the 3.7-era beta header.
+ASSESSMENT_TOOL = {
+    "name": "submit_assessment",
+    "description": "Submit the generated assessment.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "questions": {
+                "type": "array",
+                "items": {
                     "type": "object",
                     "properties": {
-                        "title": {"type": "string"},
-                        "description": {"type": "string"},
-                        "estimated_hours": {"type": "number"},
-                        "color": {"type": "string"},
-                        "icon": {"type": "string"},
-                        "learning_objectives": {"type": "array", "items": {"type": "string"}},
-                        "children": {"type": "array", "items": {"$ref": "#/$defs/module"}},
-                        "is_leaf": {"type": "boolean"},
+                        "id": {"type": "integer"},
+                        "type": {"type": "string"},
+                        "question": {"type": "string"},
+                        "options": {"type": "array", "items": {"type": "string"}},
+                        "correct_answer": {"type": "string"},
+                        "explanation": {"type": "string"},
+                        "hints": {"type": "array", "items": {"type": "string"}},
+                        "points": {"type": "integer"},
                     },
-                    "required": ["title"],
-                    "additionalProperties": False,
+                    "required": ["id", "type", "question", "correct_answer", "points"],
                 },
             },
-        }
+            "total_points": {"type": "integer"},
+            "passing_score": {"type": "integer"},
+            "time_limit_minutes": {"type": "integer"},
+        },
+        "required": ["questions", "total_points", "passing_score"],
+    },
+}
+
+WRITING_ANALYSIS_TOOL = {
+    "name": "submit_writing_analysis",
+    "description": "Submit the analysis of the student's handwritten work.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "transcription": {"type": "string"},
+            "analysis": {"type": "string"},
+            "is_correct": {"type": ["boolean", "string"], "description": 'true, false, or "partial"'},
+            "errors": {"type": "array", "items": {"type": "string"}},
+            "suggestions": {"type": "array", "items": {"type": "string"}},
+            "mastery_indication": {"type": "integer", "description": "0-100"},
+        },
+        "required": ["transcription", "analysis", "is_correct", "mastery_indication"],
+    },
+}
+
+# Anthropic ignores cache breakpoints on prefixes under 1024 tokens (Sonnet/Opus; 2048 on Haiku).
+# At roughly 4 characters per token, shorter prefixes are sent without a cache marker.
+CACHE_MIN_PREFIX_CHARS = 1024 * 4
+
+
+def _system_blocks(static_prompt: str, dynamic_context: str, cache_context: bool = False) -> List[Dict[str, Any]]:
+    """Build a system prompt from the fixed instructions followed by the per-call context.
+
+    Set cache_context when the context is reused across calls (e.g. one tutoring session); the
+    prefix is only marked for prompt caching once it is long enough for Anthropic to cache it.
+    """
+    context_block = {"type": "text", "text": dynamic_context}
+    if cache_context and len(static_prompt) + len(dynamic_context) >= CACHE_MIN_PREFIX_CHARS:
+        context_block["cache_control"] = {"type": "ephemeral"}
+    return [
+        {"type": "text", "text": static_prompt},
+        context_block,
+    ]
+
+
+def _stream_text(client, **kwargs) -> str:
+    """Run a Messages request over the streaming endpoint and return the full reply text.
+
+    Long generations stay on one live connection instead of a single buffered response
+    (the SDK refuses non-streaming calls it expects to run past its timeout).
+    """
+    with client.messages.stream(**kwargs) as stream:
+        return stream.get_final_text()
+
+
+def _tool_input(message) -> Optional[Dict[str, Any]]:
+    """Return the input of the first tool_use block in a Message, or None."""
+    for block in message.content:
+        if block.type == "tool_use" and isinstance(block.input, dict):
+            return block.input
+    return None
+
+
+def _tool_params(tool: Dict[str, Any]) -> Dict[str, Any]:
+    """Request parameters that force Claude to answer through `tool` (valid JSON by construction)."""
+    return {"tools": [tool], "tool_choice": {"type": "tool", "name": tool["name"]}}
+
+
+def _stream_tool_output(client, **kwargs) -> Tuple[Optional[Dict[str, Any]], str]:
+    """Stream a forced tool-use request. Returns (tool input or JSON found in the text, reply text)."""
+    with client.messages.stream(**kwargs) as stream:
+        message = stream.get_final_message()
+    text = "".join(b.text for b in message.content if b.type == "text")
+    result = _tool_input(message)
+    if result is None:
+        result = _extract_json(text)
+    return result, text
+
+
+# One Anthropic client per API key, keyed by the key's sha256 so raw keys are not held as dict keys
+CLIENT_CACHE_MAXSIZE = 256
+_clients = LRUCache(maxsize=CLIENT_CACHE_MAXSIZE)  # least recently used teacher key is evicted first
+_clients_lock = threading.Lock()
+_env_client = None  # client for ANTHROPIC_API_KEY, resolved on first use
+
+
+def _client_for_key(key: str):
+    """Return the shared Anthropic client for key; its httpx pool keeps connections alive across calls."""
+    key_hash = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    with _clients_lock:
+        # LRUCache reorders on lookup, so reads need the lock too
+        client = _clients.get(key_hash)
+        if client is None:
+            import httpx
+            from anthropic import DEFAULT_TIMEOUT, Anthropic
+            client = Anthropic(
+                api_key=key,
+                max_retries=2,
+                http_client=httpx.Client(
+                    limits=httpx.Limits(max_keepalive_connections=20),
+                    timeout=DEFAULT_TIMEOUT,  # keep the SDK's 10-minute default for long generations
+                ),
+            )
+            _clients[key_hash] = client
+    return client
+
+
+def get_claude_client(api_key: Optional[str] = None):
+    """Get Anthropic client. Uses api_key if provided, else ANTHROPIC_API_KEY env."""
+    try:
+        import anthropic  # noqa: F401
+    except ImportError:
+        logger.warning("anthropic package not installed; run: pip install anthropic")
+        return None
+    global _env_client
+    if not api_key:
+        # Server key: skip the env read and key hashing on every tutor turn once resolved
+        if _env_client is None:
+            key = (os.getenv("ANTHROPIC_API_KEY") or "").strip()
+            if not key:
+                return None
+            _env_client = _client_for_key(key)
+        return _env_client
+    if not api_key.strip():
+        return None
+    return _client_for_key(api_key.strip())
+
+
+# Changes whenever the module-generation prompt changes, so cached trees from an older prompt are not reused
+MODULE_PROMPT_VERSION = hashlib.sha256(MODULE_GENERATION_PROMPT.encode('utf-8')).hexdigest()[:8]
+
+
+def syllabus_cache_key(file_content: bytes, subject: str, year_level: str) -> str:
+    """Cache key for a generated module tree: syllabus content hash + subject + year level + prompt version."""
+    content_hash = hashlib.sha256(file_content).hexdigest()[:16]
+    return f"{content_hash}:{subject}:{year_level}:{MODULE_PROMPT_VERSION}"
+
+
+# Syllabus text above this size is condensed chunk-by-chunk with a cheap model before the Opus call
+SYLLABUS_MAX_CHARS = int(os.getenv("SYLLABUS_MAX_CHARS", "400000"))
+SYLLABUS_CHUNK_CHARS = 100_000
+SYLLABUS_DIGEST_MODEL = "claude-3-5-haiku-20241022"
+SYLLABUS_DIGEST_WORKERS = 4
+
+_PAGE_BOUNDARY_RE = re.compile(r'(?=--- Page \d+ ---)')
+
+
+def _chunk_for_context(text: str, max_chars: int = SYLLABUS_CHUNK_CHARS) -> List[str]:
+    """Split extracted PDF text into chunks of at most max_chars, on page boundaries where possible."""
+    chunks = []
+    current = ""
+    for page in _PAGE_BOUNDARY_RE.split(text):
+        while len(page) > max_chars:  # a single huge page: hard split
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(page[:max_chars])
+            page = page[max_chars:]
+        if len(current) + len(page) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += page
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+
+def _digest_syllabus_chunk(client, chunk: str, subject: str, year_level: str) -> str:
+    """Condense one chunk of a long syllabus into its topics and learning objectives."""
+    return _stream_text(
+        client,
+        model=SYLLABUS_DIGEST_MODEL,
+        max_tokens=4000,
+        messages=[{
+            "role": "user",
+            "content": (
+                f"This is part of a {subject} ({year_level}) syllabus/scheme of work. "
+                "List every topic and sub-topic it covers, in order, with their learning objectives "
+                "and any suggested hours. Be concise; output only the outline.\n\n" + chunk
+            ),
+        }],
+    )
+
+
+def _condense_syllabus(client, text: str, subject: str, year_level: str) -> str:
+    """Map step for long syllabi: outline each chunk in parallel and join the outlines in document order."""
+    from concurrent.futures import ThreadPoolExecutor
+    chunks = _chunk_for_context(text)
+    logger.info("Syllabus text is %d chars; condensing %d chunks", len(text), len(chunks))
+    with ThreadPoolExecutor(max_workers=min(SYLLABUS_DIGEST_WORKERS, len(chunks))) as ex:
+        outlines = list(ex.map(lambda c: _digest_syllabus_chunk(client, c, subject, year_level), chunks))
+    return "\n\n".join(outlines)
+
+
+def generate_modules_from_syllabus(
+    file_content: bytes,
+    file_type: str,
+    subject: str,
+    year_level: str,
+    teacher_id: str,
+    api_key: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Generate hierarchical module structure from uploaded syllabus/scheme of work.
+
+    Args:
+        file_content: PDF or Word document bytes
+        file_type: 'pdf' or 'docx'
+        subject: Subject name
+        year_level: e.g., "Secondary 3"
+        teacher_id: Owner teacher ID
+        api_key: Optional Anthropic API key (e.g. from teacher settings); else uses ANTHROPIC_API_KEY env.
+
+    Returns:
+        Dictionary with module tree structure
+    """
+    client = get_claude_client(api_key=api_key)
+    if not client:
+        return {"error": AI_UNAVAILABLE_MSG}
+
+    try:
+        content = []
+
+        if file_type == 'pdf':
+            # Extract text from PDF (Claude API doesn't accept PDF as image)
+            pdf_text = _extract_text_from_pdf(file_content)
+            if not pdf_text.strip():
+                return {"error": "Could not extract text from PDF. The PDF may contain only images or be corrupted."}
+            if len(pdf_text) > SYLLABUS_MAX_CHARS:
+                content.append({
+                    "type": "text",
+                    "text": f"SYLLABUS/SCHEME OF WORK (topic outline of a long document):\n\n{_condense_syllabus(client, pdf_text, subject, year_level)}",
+                })
+            else:
+                content.append({
+                    "type": "text",
+                    "text": f"SYLLABUS/SCHEME OF WORK DOCUMENT:\n\n{pdf_text}",
+                })
+        else:
+            content.append({
+                "type": "text",
+                "text": f"[Document content for {subject} - upload PDF for full analysis]",
+            })
+
+        content.append({
+            "type": "text",
+            "text": f"""
+Subject: {subject}
+Year Level: {year_level}
+
+Analyze this document and create a comprehensive module hierarchy.
+Ensure all topics from the syllabus are covered.
+Respond with valid JSON only (no markdown, no text outside the JSON). Escape any double quotes inside string values with backslash.""",
+        })
 
         create_kwargs = {
             "model": "claude-opus-4-5",
             "max_tokens": 20000,
-            "system": system_prompt,
+            # No per-course block: subject/year are in the user message so the system prompt is identical for every teacher
+            "system": [{"type": "text", "text": MODULE_GENERATION_PROMPT}],
             "messages": [{"role": "user", "content": content}],
         }
         create_kwargs["output_config"] = {
-            "format": {"type": "json_schema", "schema": module_schema},
+            "format": {"type": "json_schema", "schema": _MODULE_SCHEMA},
         }
 
         used_structured = False
         try:
-            message = client.messages.create(**create_kwargs)
+            response_text = _stream_text(client, **create_kwargs)
             used_structured = True
         except Exception as api_err:
             # If structured output is rejected (e.g. schema too complex), retry without it
             logger.warning("Structured output failed, retrying without: %s", api_err)
             create_kwargs.pop("output_config", None)
-            message = client.messages.create(**create_kwargs)
+            response_text = _stream_text(client, **create_kwargs)
 
-        response_text = message.content[0].text
         json_str = response_text.strip() if used_structured else _extract_and_repair_json(response_text)
 
         if json_str:
             try:
-                return json.loads(json_str)
-            except json.JSONDecodeError as je:
+                return orjson.loads(json_str)
+            except orjson.JSONDecodeError as je:
                 logger.error("JSON parse error: %s\nRaw (first 2000 chars): %s", je, json_str[:2000])
                 return {'error': f'AI returned invalid JSON. Please try again. (Parse error: {je.msg} at position {je.pos})'}
         return {'error': 'Could not parse module structure from AI response'}
@@ -279,6 +731,75 @@ Respond with valid JSON only (no markdown, no text outside the JSON). Escape any
         return {'error': str(e)}
 
 
+# Tutor chat: the most recent messages are sent verbatim, older ones as a rolling summary
+HISTORY_RECENT_MESSAGES = 6
+# Only re-summarize once this many older messages have piled up (avoids a summary call every turn)
+HISTORY_SUMMARY_BATCH = 4
+HISTORY_SUMMARY_MODEL = "claude-3-5-haiku-20241022"
+
+
+def _format_chat_line(m: Dict) -> str:
+    """One 'Student:/Tutor:' line, or '' for a short student acknowledgement."""
+    content = (m.get('content') or '').strip()
+    if m.get('role') != 'student':
+        return "Tutor: " + content
+    return "Student: " + content if len(content) >= 4 else ""
+
+
+def _format_chat_history(messages: List[Dict]) -> str:
+    """Format chat turns as 'Student:/Tutor:' lines, dropping short student acknowledgements."""
+    return "\n".join(line for line in map(_format_chat_line, messages) if line)
+
+
+def condense_chat_history(
+    chat_history: List[Dict],
+    summary: Optional[str] = None,
+    summarized_upto: int = 0,
+) -> tuple:
+    """
+    Fold older chat turns into a short rolling summary so tutor prompts stay small.
+
+    Args:
+        chat_history: Full chat history of the learning session
+        summary: Summary stored on the session so far (covers chat_history[:summarized_upto])
+        summarized_upto: Number of leading messages already covered by summary
+
+    Returns:
+        (summary, summarized_upto) - unchanged if nothing new needed summarizing or the call failed
+    """
+    cutoff = len(chat_history) - HISTORY_RECENT_MESSAGES
+    if cutoff - summarized_upto < HISTORY_SUMMARY_BATCH:
+        return summary, summarized_upto
+
+    client = get_claude_client()
+    if not client:
+        return summary, summarized_upto
+
+    new_text = _format_chat_history(chat_history[summarized_upto:cutoff])
+    if not new_text:
+        return summary, cutoff
+
+    prompt = "Summarize this tutoring conversation for the tutor's memory in under 150 words. " \
+             "Keep what was taught, questions asked, how the student answered, and misconceptions seen.\n\n"
+    if summary:
+        prompt += f"SUMMARY SO FAR:\n{summary}\n\n"
+    prompt += f"NEW CONVERSATION:\n{new_text}"
+
+    try:
+        message = client.messages.create(
+            model=HISTORY_SUMMARY_MODEL,
+            max_tokens=200,
+            messages=[{"role": "user", "content": prompt}],
+        )
+        new_summary = (message.content[0].text if message.content else "").strip()
+        if not new_summary:
+            return summary, summarized_upto
+        return new_summary, cutoff
+    except Exception as e:
+        logger.warning("Could not summarize chat history: %s", e)
+        return summary, summarized_upto
+
+
 def assess_student_understanding(
     student_message: str,
     module: Dict,
@@ -286,6 +807,7 @@ def assess_student_understanding(
     student_profile: Optional[Dict] = None,
     writing_image: Optional[bytes] = None,
     textbook_context: Optional[str] = None,
+    history_summary: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
     AI learning agent that assesses student understanding and provides teaching.
@@ -293,10 +815,11 @@ def assess_student_understanding(
     Args:
         student_message: Student's chat message or question
         module: Current module being studied
-        chat_history: Previous messages in this session
+        chat_history: Previous messages in this session (not yet covered by history_summary)
         student_profile: Student's learning profile (strengths/weaknesses)
         writing_image: Optional image of student's handwritten work
         textbook_context: Optional RAG passages from the course textbook to ground answers
+        history_summary: Optional rolling summary of earlier turns (see condense_chat_history)
 
     Returns:
         Dictionary with response, assessment, and profile updates
@@ -326,67 +849,35 @@ TEACHER'S CUSTOM PROMPT FOR THIS MODULE (follow these instructions):
 {custom_prompt}
 
 """
-        book_block = ""
-        if textbook_context and textbook_context.strip():
-            book_block = f"""
-RELEVANT TEXTBOOK PASSAGES (use these to ground your answer when appropriate):
-{textbook_context}
-
-"""
-        system_prompt = f"""You are an expert, patient tutor helping a student learn.
-
-CURRENT MODULE: {module.get('title', 'Unknown')}
+        # Stable for the whole session, so it is cached along with the static prompt.
+        # Textbook passages change every turn and go in the user message instead.
+        module_context = f"""CURRENT MODULE: {module.get('title', 'Unknown')}
 LEARNING OBJECTIVES: {', '.join(module.get('learning_objectives', []))}
-{custom_block}{book_block}{profile_context}
-
-YOUR ROLE:
-1. TEACH: Explain concepts clearly, use examples, adapt to student's level
-2. ASSESS: Ask questions to check understanding, identify misconceptions
-3. ENCOURAGE: Be supportive, celebrate progress, build confidence
-4. ADAPT: Use the student's learning profile to personalize teaching
-
-ASSESSMENT GUIDELINES:
-- After teaching a concept, ask a question to assess understanding
-- If student answers correctly: Award mastery points (mastery_change 1-10), move to next concept
-- If student struggles: Provide hints, break down the problem, try different explanations
-- Note any patterns in mistakes for profile updates
-
-RESPONSE FORMAT - Respond with valid JSON only (no markdown):
-{{
-    "response": "Your teaching response to the student (use markdown for formatting, include examples)",
-    "response_type": "teaching",
-    "assessment": {{
-        "question_asked": "The assessment question if any",
-        "student_answer_correct": true,
-        "mastery_change": 5,
-        "concept_assessed": "Specific concept tested"
-    }},
-    "profile_updates": {{
-        "new_strength": null,
-        "new_weakness": null,
-        "new_mistake_pattern": null
-    }},
-    "next_action": "continue_teaching",
-    "interactive_element": null
-}}
-
-Use "response_type" one of: teaching, assessment, feedback, encouragement.
-Use "mastery_change" between -10 and 10. Use "next_action" one of: continue_teaching, assess_understanding, review_previous, module_complete."""
+{custom_block}{profile_context}"""
 
         messages_content = []
 
-        if chat_history:
-            history_text = "\n".join([
-                f"{'Student' if m.get('role') == 'student' else 'Tutor'}: {m.get('content', '')}"
-                for m in chat_history[-10:]
-            ])
-            messages_content.append({
+        if history_summary:
+            # Only changes when older turns are re-summarized: cache the prefix up to here
+            summary_block = {
                 "type": "text",
-                "text": f"RECENT CONVERSATION:\n{history_text}\n\n",
-            })
+                "text": f"EARLIER IN THIS SESSION (summary):\n{history_summary}\n\n",
+            }
+            prefix_chars = len(TUTOR_PROMPT) + len(module_context) + len(summary_block["text"])
+            if prefix_chars >= CACHE_MIN_PREFIX_CHARS:
+                summary_block["cache_control"] = {"type": "ephemeral"}
+            messages_content.append(summary_block)
+
+        if chat_history:
+            history_text = _format_chat_history(chat_history[-10:])
+            if history_text:
+                messages_content.append({
+                    "type": "text",
+                    "text": f"RECENT CONVERSATION:\n{history_text}\n\n",
+                })
 
         if writing_image:
-            image_b64 = base64.standard_b64encode(writing_image).decode('utf-8')
+            image_b64 = _b64(_prepare_image(writing_image))
             messages_content.append({"type": "text", "text": "STUDENT'S HANDWRITTEN WORK:"})
             messages_content.append({
                 "type": "image",
@@ -397,22 +888,26 @@ Use "mastery_change" between -10 and 10. Use "next_action" one of: continue_teac
                 },
             })
 
+        if textbook_context and textbook_context.strip():
+            messages_content.append({
+                "type": "text",
+                "text": f"RELEVANT TEXTBOOK PASSAGES (use these to ground your answer when appropriate):\n{textbook_context}\n\n",
+            })
+
         messages_content.append({
             "type": "text",
             "text": f"STUDENT'S MESSAGE: {student_message}\n\nRespond with JSON only:",
         })
 
-        message = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=2000,
-            system=system_prompt,
-            messages=[{"role": "user", "content": messages_content}],
-        )
-
-        response_text = message.content[0].text
-        json_match = re.search(r'\{[\s\S]*\}', response_text)
-        if json_match:
-            result = json.loads(json_match.group())
+        create_kwargs = {
+            "model": "claude-sonnet-4-20250514",
+            "max_tokens": 2000,
+            "system": _system_blocks(TUTOR_PROMPT, module_context, cache_context=True),
+            "messages": [{"role": "user", "content": messages_content}],
+        }
+        response_text = _stream_text(client, **create_kwargs)
+        result = _extract_json(response_text)
+        if result is not None:
             result['raw_response'] = response_text
             return result
 
@@ -431,6 +926,24 @@ Use "mastery_change" between -10 and 10. Use "next_action" one of: continue_teac
         }
 
 
+ASSESSMENT_MODEL = "claude-sonnet-4-20250514"
+
+
+def _assessment_params(module: Dict, difficulty: str, question_type: str) -> Dict[str, Any]:
+    """Messages API parameters for one module's assessment."""
+    assessment_context = f"""MODULE: {module.get('title')}
+OBJECTIVES: {', '.join(module.get('learning_objectives', []))}
+DIFFICULTY: {difficulty}
+QUESTION TYPE: {question_type}"""
+    return {
+        "model": ASSESSMENT_MODEL,
+        "max_tokens": 2000,
+        "system": _system_blocks(ASSESSMENT_PROMPT, assessment_context),
+        "messages": [{"role": "user", "content": "Generate the assessment now."}],
+        **_tool_params(ASSESSMENT_TOOL),
+    }
+
+
 def generate_interactive_assessment(
     module: Dict,
     difficulty: str = "medium",
@@ -452,45 +965,9 @@ def generate_interactive_assessment(
         return {'error': 'AI service not available'}
 
     try:
-        system_prompt = f"""Generate an interactive assessment for this learning module.
-
-MODULE: {module.get('title')}
-OBJECTIVES: {', '.join(module.get('learning_objectives', []))}
-DIFFICULTY: {difficulty}
-QUESTION TYPE: {question_type}
-
-Create 5 questions that test understanding of the learning objectives.
-
-Respond with valid JSON only:
-{{
-    "questions": [
-        {{
-            "id": 1,
-            "type": "mcq",
-            "question": "...",
-            "options": ["A) ...", "B) ...", "C) ...", "D) ..."],
-            "correct_answer": "B",
-            "explanation": "Why B is correct...",
-            "hints": ["Hint 1", "Hint 2"],
-            "points": 10
-        }}
-    ],
-    "total_points": 50,
-    "passing_score": 35,
-    "time_limit_minutes": 15
-}}"""
-
-        message = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=2000,
-            system=system_prompt,
-            messages=[{"role": "user", "content": "Generate the assessment now."}],
-        )
-
-        response_text = message.content[0].text
-        json_match = re.search(r'\{[\s\S]*\}', response_text)
-        if json_match:
-            return json.loads(json_match.group())
+        result, _ = _stream_tool_output(client, **_assessment_params(module, difficulty, question_type))
+        if result is not None:
+            return result
         return {'error': 'Could not generate assessment'}
 
     except Exception as e:
@@ -565,17 +1042,16 @@ Respond with valid JSON only. No markdown, no text outside the JSON."""
         }
         user_content = f"Generate a {interactive_type} interactive. Schema: {schema.get(interactive_type, schema['guided_steps'])}"
 
-        message = client.messages.create(
+        response_text = _stream_text(
+            client,
             model="claude-sonnet-4-20250514",
             max_tokens=1500,
             system=system_prompt,
             messages=[{"role": "user", "content": user_content}],
         )
 
-        response_text = message.content[0].text
-        json_match = re.search(r'\{[\s\S]*\}', response_text)
-        if json_match:
-            out = json.loads(json_match.group())
+        out = _extract_json(response_text)
+        if out is not None:
             out["interactive_type"] = interactive_type
             return out
         return {'error': 'Could not generate interactive', 'interactive_type': interactive_type}
@@ -606,34 +1082,18 @@ def analyze_writing_submission(
         return {'error': 'AI service not available'}
 
     try:
-        image_b64 = base64.standard_b64encode(image_data).decode('utf-8')
-
-        system_prompt = f"""Analyze this student's handwritten work for the module: {module.get('title')}
-
-{('Expected content: ' + expected_content) if expected_content else ''}
-
-Evaluate:
-1. Mathematical/logical correctness
-2. Clarity of presentation
-3. Method and approach used
-4. Any errors or misconceptions
+        image_b64 = _b64(_prepare_image(image_data))
 
-Respond with valid JSON only:
-{{
-    "transcription": "Text version of what's written",
-    "analysis": "Detailed analysis of the work",
-    "is_correct": true,
-    "errors": [],
-    "suggestions": [],
-    "mastery_indication": 75
-}}
-
-Use is_correct: true, false, or "partial". mastery_indication is 0-100."""
+        writing_context = f"MODULE: {module.get('title')}"
+        if expected_content:
+            writing_context += f"\nExpected content: {expected_content}"
 
-        message = client.messages.create(
+        result, response_text = _stream_tool_output(
+            client,
             model="claude-sonnet-4-20250514",
             max_tokens=1500,
-            system=system_prompt,
+            system=_system_blocks(WRITING_ANALYSIS_PROMPT, writing_context),
+            **_tool_params(WRITING_ANALYSIS_TOOL),
             messages=[
                 {
                     "role": "user",
@@ -646,16 +1106,14 @@ Use is_correct: true, false, or "partial". mastery_indication is 0-100."""
                                 "data": image_b64,
                             },
                         },
-                        {"type": "text", "text": "Analyze this handwritten work and respond with JSON only:"},
+                        {"type": "text", "text": "Analyze this handwritten work."},
                     ],
                 }
             ],
         )
 
-        response_text = message.content[0].text
-        json_match = re.search(r'\{[\s\S]*\}', response_text)
-        if json_match:
-            return json.loads(json_match.group())
+        if result is not None:
+            return result
         return {'analysis': response_text}
 
     except Exception as e:
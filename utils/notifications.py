@@ -4,35 +4,58 @@ from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+SUBMITTED_AT_FORMAT = '%d %b %Y, %H:%M'
+
+_bot_handler = None
+_bot_handler_loaded = False
+
+
+def _get_bot_handler():
+    """
+    Import bot_handler on first use and remember it (deferred to avoid circular imports).
+    Returns None if the bot is not available.
+    """
+    global _bot_handler, _bot_handler_loaded
+    if not _bot_handler_loaded:
+        try:
+            import bot_handler
+            _bot_handler = bot_handler
+        except ImportError:
+            logger.warning("bot_handler not available for notifications")
+        _bot_handler_loaded = True
+    return _bot_handler
+
 def notify_submission_ready(submission: dict, assignment: dict, student: dict, teacher: dict):
     """
     Notify teacher when a student submission is ready for review
-    
-    This function imports bot_handler to avoid circular imports
     """
+    bot_handler = _get_bot_handler()
+    if bot_handler is None:
+        return False
     try:
-        from bot_handler import send_notification
-        
         telegram_id = teacher.get('telegram_id')
         if not telegram_id:
             logger.warning(f"Teacher {teacher.get('teacher_id')} has no Telegram ID linked")
             return False
         
+        sub_at = submission.get('submitted_at')
+        if isinstance(sub_at, datetime):
+            submitted_at = sub_at.strftime(SUBMITTED_AT_FORMAT)
+        else:
+            submitted_at = str(sub_at) if sub_at else 'Just now'
+        
         data = {
             'student_name': student.get('name', 'Unknown'),
             'student_class': student.get('class'),
             'student_id': student.get('student_id', 'N/A'),
             'assignment_title': assignment.get('title', 'Untitled'),
             'subject': assignment.get('subject', 'N/A'),
-            'submitted_at': submission.get('submitted_at', datetime.utcnow()).strftime('%d %b %Y, %H:%M') if isinstance(submission.get('submitted_at'), datetime) else str(submission.get('submitted_at', 'Just now')),
+            'submitted_at': submitted_at,
             'submission_id': submission.get('submission_id', '')
         }
         
-        return send_notification(telegram_id, 'new_submission', data)
+        return bot_handler.send_notification(telegram_id, 'new_submission', data)
         
-    except ImportError:
-        logger.warning("bot_handler not available for notifications")
-        return False
     except Exception as e:
         logger.error(f"Error sending notification: {e}")
         return False
@@ -45,8 +68,6 @@ def notify_feedback_ready(submission: dict, assignment: dict, student: dict):
     or could be implemented as an email notification
     """
     try:
-        from bot_handler import send_notification
-        
         # For now, we'll log this - in a full implementation,
         # students could also link their Telegram accounts
         logger.info(f"Feedback ready for {student.get('name')} on {assignment.get('title')}")
@@ -66,9 +87,10 @@ def notify_correction_challenge_received(submission: dict, assignment: dict, stu
     """
     Notify teacher when a student sends corrections or challenges feedback.
     """
+    bot_handler = _get_bot_handler()
+    if bot_handler is None:
+        return False
     try:
-        from bot_handler import send_notification
-
         telegram_id = teacher.get('telegram_id')
         if not telegram_id:
             logger.warning(f"Teacher {teacher.get('teacher_id')} has no Telegram ID linked")
@@ -83,10 +105,7 @@ def notify_correction_challenge_received(submission: dict, assignment: dict, stu
             'submission_id': submission.get('submission_id', ''),
         }
 
-        return send_notification(telegram_id, 'correction_challenge_received', data)
-    except ImportError:
-        logger.warning("bot_handler not available for notifications")
-        return False
+        return bot_handler.send_notification(telegram_id, 'correction_challenge_received', data)
     except Exception as e:
         logger.error(f"Error sending correction notification: {e}")
         return False
@@ -96,15 +115,16 @@ def notify_new_message(teacher: dict, student: dict, message: str):
     """
     Notify teacher of a new message from student
     """
+    bot_handler = _get_bot_handler()
+    if bot_handler is None:
+        return False
     try:
-        from bot_handler import send_to_teacher
-        
         telegram_id = teacher.get('telegram_id')
         if not telegram_id:
             logger.warning(f"Teacher {teacher.get('teacher_id')} has no Telegram ID linked")
             return False
         
-        return send_to_teacher(
+        return bot_handler.send_to_teacher(
             telegram_id=telegram_id,
             student_name=student.get('name', 'Unknown'),
             message=message,
@@ -112,25 +132,40 @@ def notify_new_message(teacher: dict, student: dict, message: str):
             student_class=student.get('class')
         )
         
-    except ImportError:
-        logger.warning("bot_handler not available for notifications")
-        return False
     except Exception as e:
         logger.error(f"Error sending message notification: {e}")
         return False
 
 def notify_assignment_published(assignment: dict, students: list, teacher: dict):
     """
-    Notify students when a new assignment is published
+    Notify students with a linked Telegram account when a new assignment is published
     
-    This would require student Telegram integration
+    Messages are sent concurrently rather than one round-trip per student
     """
     logger.info(f"New assignment '{assignment.get('title')}' published by {teacher.get('name')}")
-    logger.info(f"Would notify {len(students)} students")
     
-    # In a full implementation, this could:
-    # 1. Send Telegram messages to students who have linked accounts
-    # 2. Send email notifications
-    # 3. Push notifications via a mobile app
-    
-    return True
+    bot_handler = _get_bot_handler()
+    if bot_handler is None:
+        return False
+    try:
+        telegram_ids = [s['telegram_id'] for s in students if s.get('telegram_id')]
+        if not telegram_ids:
+            return True
+        
+        due_date = assignment.get('due_date')
+        if isinstance(due_date, datetime):
+            due_date = due_date.strftime(SUBMITTED_AT_FORMAT)
+        
+        data = {
+            'assignment_title': assignment.get('title', 'Untitled'),
+            'subject': assignment.get('subject', 'N/A'),
+            'teacher_name': teacher.get('name'),
+            'due_date': due_date,
+        }
+        
+        bot_handler.send_notifications_bulk(telegram_ids, 'new_assignment', data)
+        return True
+        
+    except Exception as e:
+        logger.error(f"Error sending assignment notifications: {e}")
+        return False
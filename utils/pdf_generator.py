@@ -1,15 +1,34 @@
+import functools
+import heapq
 import io
 import logging
+import os
+from bisect import bisect_right
+from collections import defaultdict
 from datetime import datetime
+from operator import itemgetter
+from typing import BinaryIO, Optional
+from reportlab import rl_config
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch, cm
-from reportlab.lib.colors import HexColor, black, white
+from reportlab.lib.colors import Color, black, white
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, HRFlowable, PageBreak, Image
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_JUSTIFY, TA_RIGHT
 
 logger = logging.getLogger(__name__)
 
+DATE_FORMAT = '%d %B %Y'
+TIMESTAMP_FORMAT = '%d %B %Y, %H:%M UTC'
+
+# Print resolution for submission page images; larger photos are downscaled to it
+SUBMISSION_IMAGE_DPI = 150
+SUBMISSION_JPEG_QUALITY = 82
+
+# Attribute validation on ReportLab shapes is a development aid; keep it only when debugging PDFs
+if not os.getenv('PDF_DEBUG'):
+    rl_config.shapeChecking = 0
+
 
 def _image_bytes_to_pdf_page(image_bytes: bytes) -> bytes:
     """Convert image bytes to a single-page PDF."""
@@ -57,17 +76,28 @@ def _merge_pdf_with_marked_copy(feedback_pdf_bytes: bytes, marked_copy_files: li
         return feedback_pdf_bytes
 
 # Colors
-PRIMARY_COLOR = HexColor('#667eea')
-SECONDARY_COLOR = HexColor('#764ba2')
-SUCCESS_COLOR = HexColor('#28a745')
-DANGER_COLOR = HexColor('#dc3545')
-WARNING_COLOR = HexColor('#ffc107')
-TEXT_COLOR = HexColor('#333333')
-LIGHT_GRAY = HexColor('#f8f9fa')
-BORDER_COLOR = HexColor('#dee2e6')
+PRIMARY_COLOR = Color(0x66/255, 0x7e/255, 0xea/255)  # #667eea
+SECONDARY_COLOR = Color(0x76/255, 0x4b/255, 0xa2/255)  # #764ba2
+SUCCESS_COLOR = Color(0x28/255, 0xa7/255, 0x45/255)  # #28a745
+DANGER_COLOR = Color(0xdc/255, 0x35/255, 0x45/255)  # #dc3545
+WARNING_COLOR = Color(0xff/255, 0xc1/255, 0x07/255)  # #ffc107
+TEXT_COLOR = Color(0x33/255, 0x33/255, 0x33/255)  # #333333
+LIGHT_GRAY = Color(0xf8/255, 0xf9/255, 0xfa/255)  # #f8f9fa
+BORDER_COLOR = Color(0xde/255, 0xe2/255, 0xe6/255)  # #dee2e6
+FOOTER_COLOR = Color(0x88/255, 0x88/255, 0x88/255)  # #888888
+MUTED_TEXT_COLOR = Color(0x99/255, 0x99/255, 0x99/255)  # #999999
+GRADE_B_COLOR = Color(0x17/255, 0xa2/255, 0xb8/255)  # #17a2b8
+OVERALL_BG = Color(0xe8/255, 0xf5/255, 0xe9/255)  # #e8f5e9
+ERROR_ALT_BG = Color(0xff/255, 0xf9/255, 0xe6/255)  # #fff9e6
+RESOLVED_BG = Color(0xd4/255, 0xed/255, 0xda/255)  # #d4edda
+NOTE_BG = Color(0xff/255, 0xf3/255, 0xcd/255)  # #fff3cd
 
-def get_styles():
-    """Get custom paragraph styles"""
+# Built on the first PDF rather than at import, so importing this module (done at
+# app startup) only pays for the ReportLab imports. Every PDF then reads from the
+# same stylesheet (never add() to it per call).
+@functools.lru_cache(maxsize=1)
+def _build_styles():
+    """Build the sample stylesheet plus our custom paragraph styles"""
     styles = getSampleStyleSheet()
     
     styles.add(ParagraphStyle(
@@ -131,14 +161,371 @@ def get_styles():
         name='Footer',
         parent=styles['Normal'],
         fontSize=8,
-        textColor=HexColor('#888888'),
+        textColor=FOOTER_COLOR,
         alignment=TA_CENTER
     ))
     
+    # Question heading in printed assignments
+    styles.add(ParagraphStyle(
+        name='Question',
+        parent=styles['Body_Custom'],
+        fontName='Helvetica-Bold',
+        spaceBefore=15
+    ))
+    
     return styles
 
+def get_styles():
+    """Get custom paragraph styles (shared, read-only)"""
+    return _build_styles()
+
+# Static header rows. Plain strings styled by the table's header-row commands, so no
+# Paragraph markup is parsed per PDF (and no flowable is shared between concurrent builds)
+_FEEDBACK_HEADER_ROW = ('Q#', 'Student Answer', 'Correct Answer', 'Feedback', 'Marks')
+_CRITERIA_HEADER_ROW = ('Criterion', 'AI Reasoning', 'Feedback / AFI', 'Marks')
+_ERROR_HEADER_ROW = ('Location', 'Error', 'Suggested Correction', 'Feedback')
+_STATS_HEADER_ROW = ('Metric', 'Value', 'Metric', 'Value')
+_DIST_HEADER_ROW = ('Grade', 'Count', 'Percentage')
+_DIST_LABELS = ('A (80-100%)', 'B (60-79%)', 'C (40-59%)', 'D (0-39%)')
+_STUDENT_HEADER_ROW = ('#', 'Student Name', 'Class', 'Status', 'Score', 'Grade')
+
+# Shared default for "no teacher edits" lookups; only ever read, never mutated
+_EMPTY = {}
+
+# Per-question status glyphs
+_STATUS_OK = "✓"
+_STATUS_BAD = "✗"
+_STATUS_UNKNOWN = "?"
+
+# Table styles shared by every PDF (TableStyle is not modified by Table.setStyle)
+_INFO_TABLE_STYLE = TableStyle([
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('TEXTCOLOR', (0, 0), (-1, -1), TEXT_COLOR),
+    ('BACKGROUND', (0, 0), (-1, -1), LIGHT_GRAY),
+    ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
+    ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
+    ('PADDING', (0, 0), (-1, -1), 6),
+])
+
+_SCORE_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, -1), PRIMARY_COLOR),
+    ('TEXTCOLOR', (0, 0), (-1, -1), white),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('PADDING', (0, 0), (-1, -1), 10),
+    ('BOX', (0, 0), (-1, -1), 2, PRIMARY_COLOR),
+])
+
+_FEEDBACK_TABLE_STYLE = TableStyle([
+    # Header row
+    ('BACKGROUND', (0, 0), (-1, 0), PRIMARY_COLOR),
+    ('TEXTCOLOR', (0, 0), (-1, 0), white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 9),
+    ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+    # Alternating rows
+    ('BACKGROUND', (0, 1), (-1, -1), white),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [white, LIGHT_GRAY]),
+    # Borders
+    ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
+    ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
+    # Alignment
+    ('ALIGN', (0, 0), (0, -1), 'CENTER'),
+    ('ALIGN', (-1, 0), (-1, -1), 'CENTER'),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    # Q#/status and Marks columns hold plain strings; match the bold TableCell text
+    ('FONTNAME', (0, 1), (0, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 1), (0, -1), 9),
+    ('TEXTCOLOR', (0, 1), (0, -1), TEXT_COLOR),
+    ('FONTNAME', (-1, 1), (-1, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (-1, 1), (-1, -1), 9),
+    ('TEXTCOLOR', (-1, 1), (-1, -1), TEXT_COLOR),
+    # Padding
+    ('PADDING', (0, 0), (-1, -1), 6),
+])
+
+_OVERALL_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, -1), OVERALL_BG),
+    ('BOX', (0, 0), (-1, -1), 1, SUCCESS_COLOR),
+    ('PADDING', (0, 0), (-1, -1), 10),
+])
+
+_CRITERIA_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), PRIMARY_COLOR),
+    ('TEXTCOLOR', (0, 0), (-1, 0), white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 9),
+    ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+    ('BACKGROUND', (0, 1), (-1, -1), white),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [white, LIGHT_GRAY]),
+    ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
+    ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
+    ('ALIGN', (-1, 0), (-1, -1), 'CENTER'),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    # Marks column holds plain strings; match the bold TableCell text
+    ('FONTNAME', (-1, 1), (-1, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (-1, 1), (-1, -1), 9),
+    ('TEXTCOLOR', (-1, 1), (-1, -1), TEXT_COLOR),
+    ('PADDING', (0, 0), (-1, -1), 6),
+])
+
+_ERROR_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), WARNING_COLOR),
+    ('TEXTCOLOR', (0, 0), (-1, 0), black),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 9),
+    ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+    ('BACKGROUND', (0, 1), (-1, -1), white),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [white, ERROR_ALT_BG]),
+    ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
+    ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ('PADDING', (0, 0), (-1, -1), 6),
+])
+
+_CLASS_INFO_TABLE_STYLE = TableStyle([
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('BACKGROUND', (0, 0), (-1, -1), LIGHT_GRAY),
+    ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
+    ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
+    ('PADDING', (0, 0), (-1, -1), 6),
+])
+
+_STATS_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), PRIMARY_COLOR),
+    ('TEXTCOLOR', (0, 0), (-1, 0), white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTNAME', (0, 1), (0, -1), 'Helvetica-Bold'),
+    ('FONTNAME', (2, 1), (2, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('ALIGN', (1, 0), (1, -1), 'CENTER'),
+    ('ALIGN', (3, 0), (3, -1), 'CENTER'),
+    ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
+    ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
+    ('PADDING', (0, 0), (-1, -1), 8),
+])
+
+_DIST_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), PRIMARY_COLOR),
+    ('TEXTCOLOR', (0, 0), (-1, 0), white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
+    ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
+    ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
+    ('PADDING', (0, 0), (-1, -1), 6),
+])
+
+# Table sizing: every Table gets explicit colWidths. Tables whose cells are all
+# single-line plain strings also get fixed rowHeights (font leading + top/bottom
+# padding), so ReportLab does not wrap every cell to measure each row; long lists
+# are split into page-sized tables. Tables of wrapping Paragraph cells (feedback,
+# criteria, errors) keep computed heights, as a fixed height would clip the text.
+
+# Height of a single-line plain-string row: ReportLab's default 12pt cell leading
+# plus 3pt top and bottom cell padding
+SINGLE_LINE_ROW_HEIGHT = 18
+
+# Class report student list: rows per table (one A4 page) and fixed row height
+STUDENT_ROWS_PER_TABLE = 36
+STUDENT_ROW_HEIGHT = SINGLE_LINE_ROW_HEIGHT
+
+_STUDENT_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), PRIMARY_COLOR),
+    ('TEXTCOLOR', (0, 0), (-1, 0), white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 8),
+    ('ALIGN', (0, 0), (0, -1), 'CENTER'),
+    ('ALIGN', (3, 0), (-1, -1), 'CENTER'),
+    ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
+    ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [white, LIGHT_GRAY]),
+    ('PADDING', (0, 0), (-1, -1), 4),
+])
+
+# Batch feedback question table
+_BATCH_FEEDBACK_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), PRIMARY_COLOR),
+    ('TEXTCOLOR', (0, 0), (-1, 0), white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 8),
+    ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
+    ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
+    ('ALIGN', (0, 0), (2, -1), 'CENTER'),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ('PADDING', (0, 0), (-1, -1), 4),
+])
+
+# Class student list PDF
+_CLASS_LIST_INFO_TABLE_STYLE = TableStyle([
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('TEXTCOLOR', (0, 0), (-1, -1), TEXT_COLOR),
+    ('BACKGROUND', (0, 0), (-1, -1), LIGHT_GRAY),
+    ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
+    ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
+    ('PADDING', (0, 0), (-1, -1), 6),
+])
+
+_CLASS_LIST_TABLE_STYLE = TableStyle([
+    # Header row
+    ('BACKGROUND', (0, 0), (-1, 0), PRIMARY_COLOR),
+    ('TEXTCOLOR', (0, 0), (-1, 0), white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 10),
+    # Data rows
+    ('FONTSIZE', (0, 1), (-1, -1), 10),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [white, LIGHT_GRAY]),
+    # Borders
+    ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
+    ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
+    # Alignment
+    ('ALIGN', (0, 0), (0, -1), 'CENTER'),
+    ('ALIGN', (1, 0), (1, -1), 'CENTER'),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    # Padding
+    ('PADDING', (0, 0), (-1, -1), 8),
+])
+
+# Duplicate student report
+_DUPLICATE_GROUP_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), PRIMARY_COLOR),
+    ('TEXTCOLOR', (0, 0), (-1, 0), white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 8),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [white, LIGHT_GRAY]),
+    ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
+    ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('PADDING', (0, 0), (-1, -1), 5),
+    # Highlight the "KEEP" row
+    ('BACKGROUND', (-1, 1), (-1, 1), RESOLVED_BG),
+])
+
+_MAPPING_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), SUCCESS_COLOR),
+    ('TEXTCOLOR', (0, 0), (-1, 0), white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [white, RESOLVED_BG]),
+    ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
+    ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
+    ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('PADDING', (0, 0), (-1, -1), 6),
+])
+
+# Affected teachers report
+_ID_UPDATE_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), PRIMARY_COLOR),
+    ('TEXTCOLOR', (0, 0), (-1, 0), white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [white, LIGHT_GRAY]),
+    ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
+    ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
+    ('ALIGN', (1, 0), (2, -1), 'CENTER'),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('PADDING', (0, 0), (-1, -1), 6),
+    # Highlight the kept ID column
+    ('BACKGROUND', (1, 1), (1, -1), RESOLVED_BG),
+    # Strikethrough effect for old IDs
+    ('TEXTCOLOR', (2, 1), (2, -1), MUTED_TEXT_COLOR),
+])
+
+_NOTE_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, -1), NOTE_BG),
+    ('BOX', (0, 0), (-1, -1), 1, WARNING_COLOR),
+    ('PADDING', (0, 0), (-1, -1), 10),
+])
+
+
+def _output_buffer(output_stream, marked_copy_files: list = None):
+    """Pick the stream doc.build() writes into.
+    
+    A caller-supplied stream is written to directly unless marked copy pages
+    still have to be merged in, which needs the finished PDF as bytes.
+    """
+    if output_stream is not None and not marked_copy_files:
+        return output_stream
+    return io.BytesIO()
+
+def _finish_output(buffer, output_stream, marked_copy_files: list = None) -> Optional[bytes]:
+    """Return the built PDF as bytes, or write it to output_stream and return None"""
+    if buffer is output_stream:
+        return None
+    
+    pdf_bytes = buffer.getvalue()
+    
+    # Append marked copy pages for assessments
+    if marked_copy_files:
+        pdf_bytes = _merge_pdf_with_marked_copy(pdf_bytes, marked_copy_files)
+    
+    if output_stream is not None:
+        output_stream.write(pdf_bytes)
+        return None
+    return pdf_bytes
+
+def _build_info_table(student: dict, assignment: dict, now: datetime) -> Table:
+    """Student/assignment info box shown at the top of a feedback report"""
+    info_data = [
+        ['Student:', student.get('name', 'Unknown'), 'Date:', now.strftime(DATE_FORMAT)],
+        ['ID:', student.get('student_id', 'N/A'), 'Class:', student.get('class', 'N/A')],
+        ['Assignment:', assignment.get('title', 'Untitled'), 'Subject:', assignment.get('subject', 'N/A')],
+    ]
+    info_table = Table(info_data, colWidths=[2*cm, 6*cm, 2*cm, 6*cm])
+    info_table.setStyle(_INFO_TABLE_STYLE)
+    return info_table
+
+def _build_score_table(final_marks, total_marks, styles):
+    """Total score / percentage / grade box, or None if the submission has no marks yet"""
+    if final_marks is None:
+        return None
+    
+    # Convert to float if string
+    try:
+        final_marks = float(final_marks) if isinstance(final_marks, str) else final_marks
+    except (ValueError, TypeError):
+        final_marks = 0
+    
+    if isinstance(total_marks, str):
+        try:
+            total_marks = float(total_marks)
+        except (ValueError, TypeError):
+            total_marks = 100
+    
+    percentage = (float(final_marks) / float(total_marks) * 100) if total_marks > 0 else 0
+    grade = get_grade(percentage)
+    
+    score_data = [[
+        Paragraph(f"<b>Total Score</b>", styles['TableCell']),
+        Paragraph(f"<b>{final_marks} / {total_marks}</b>", styles['TableCell']),
+        Paragraph(f"<b>{percentage:.1f}%</b>", styles['TableCell']),
+        Paragraph(f"<b>Grade: {grade}</b>", styles['TableCell'])
+    ]]
+    
+    score_table = Table(score_data, colWidths=[4*cm, 4*cm, 4*cm, 4*cm])
+    score_table.setStyle(_SCORE_TABLE_STYLE)
+    return score_table
+
+def _append_footer(story: list, teacher: dict, styles, now: datetime):
+    """Append the 'Reviewed by ... | Generated ...' footer to a feedback report"""
+    story.append(Spacer(1, 30))
+    story.append(HRFlowable(width="100%", thickness=1, color=BORDER_COLOR))
+    story.append(Spacer(1, 5))
+    
+    teacher_name = teacher.get('name', 'Teacher') if teacher else 'Teacher'
+    footer_text = f"Reviewed by: {teacher_name} | Generated: {now.strftime(TIMESTAMP_FORMAT)}"
+    story.append(Paragraph(footer_text, styles['Footer']))
+
+
 def generate_review_pdf(submission: dict, assignment: dict, student: dict, teacher: dict = None,
-                       marked_copy_files: list = None) -> bytes:
+                       marked_copy_files: list = None, output_stream: BinaryIO = None) -> Optional[bytes]:
     """
     Generate a comprehensive PDF feedback report with feedback table
     
@@ -148,11 +535,12 @@ def generate_review_pdf(submission: dict, assignment: dict, student: dict, teach
         student: The student document
         teacher: Optional teacher document
         marked_copy_files: Optional list of (content_type, bytes) for assessment marked copy pages
+        output_stream: Optional writable binary stream to write the PDF into
     
     Returns:
-        PDF content as bytes
+        PDF content as bytes, or None when written to output_stream
     """
-    buffer = io.BytesIO()
+    buffer = _output_buffer(output_stream, marked_copy_files)
     doc = SimpleDocTemplate(
         buffer,
         pagesize=A4,
@@ -163,6 +551,7 @@ def generate_review_pdf(submission: dict, assignment: dict, student: dict, teach
     )
     
     styles = get_styles()
+    now = datetime.utcnow()
     story = []
     
     # Header with school info
@@ -170,63 +559,12 @@ def generate_review_pdf(submission: dict, assignment: dict, student: dict, teach
     story.append(Spacer(1, 5))
     
     # Info box
-    info_data = [
-        ['Student:', student.get('name', 'Unknown'), 'Date:', datetime.utcnow().strftime('%d %B %Y')],
-        ['ID:', student.get('student_id', 'N/A'), 'Class:', student.get('class', 'N/A')],
-        ['Assignment:', assignment.get('title', 'Untitled'), 'Subject:', assignment.get('subject', 'N/A')],
-    ]
-    
-    info_table = Table(info_data, colWidths=[2*cm, 6*cm, 2*cm, 6*cm])
-    info_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('TEXTCOLOR', (0, 0), (-1, -1), TEXT_COLOR),
-        ('BACKGROUND', (0, 0), (-1, -1), LIGHT_GRAY),
-        ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
-        ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
-        ('PADDING', (0, 0), (-1, -1), 6),
-    ]))
-    story.append(info_table)
+    story.append(_build_info_table(student, assignment, now))
     story.append(Spacer(1, 15))
     
     # Score summary box
-    final_marks = submission.get('final_marks')
-    total_marks = assignment.get('total_marks', 100)
-    
-    # Convert to float if string
-    if final_marks is not None:
-        try:
-            final_marks = float(final_marks) if isinstance(final_marks, str) else final_marks
-        except (ValueError, TypeError):
-            final_marks = 0
-    
-    if isinstance(total_marks, str):
-        try:
-            total_marks = float(total_marks)
-        except (ValueError, TypeError):
-            total_marks = 100
-    
-    if final_marks is not None:
-        percentage = (float(final_marks) / float(total_marks) * 100) if total_marks > 0 else 0
-        grade = get_grade(percentage)
-        
-        score_data = [[
-            Paragraph(f"<b>Total Score</b>", styles['TableCell']),
-            Paragraph(f"<b>{final_marks} / {total_marks}</b>", styles['TableCell']),
-            Paragraph(f"<b>{percentage:.1f}%</b>", styles['TableCell']),
-            Paragraph(f"<b>Grade: {grade}</b>", styles['TableCell'])
-        ]]
-        
-        score_table = Table(score_data, colWidths=[4*cm, 4*cm, 4*cm, 4*cm])
-        score_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), PRIMARY_COLOR),
-            ('TEXTCOLOR', (0, 0), (-1, -1), white),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('PADDING', (0, 0), (-1, -1), 10),
-            ('BOX', (0, 0), (-1, -1), 2, PRIMARY_COLOR),
-        ]))
+    score_table = _build_score_table(submission.get('final_marks'), assignment.get('total_marks', 100), styles)
+    if score_table is not None:
         story.append(score_table)
         story.append(Spacer(1, 15))
     
@@ -237,23 +575,22 @@ def generate_review_pdf(submission: dict, assignment: dict, student: dict, teach
     ai_feedback = submission.get('ai_feedback', {})
     teacher_feedback = submission.get('teacher_feedback', {})
     questions = ai_feedback.get('questions', [])
+    improvement_notes = []
     
     if questions:
         # Table headers
-        table_data = [[
-            Paragraph('<b>Q#</b>', styles['TableHeader']),
-            Paragraph('<b>Student Answer</b>', styles['TableHeader']),
-            Paragraph('<b>Correct Answer</b>', styles['TableHeader']),
-            Paragraph('<b>Feedback</b>', styles['TableHeader']),
-            Paragraph('<b>Marks</b>', styles['TableHeader'])
-        ]]
+        table_data = [list(_FEEDBACK_HEADER_ROW)]
+        
+        # Loop invariants bound once for the per-row work
+        teacher_questions = teacher_feedback.get('questions') or {}
+        cell_style = styles['TableCell']
         
         # Add rows for each question
         for q in questions:
             q_num = q.get('question_num', '?')
             
             # Get teacher edits if available
-            teacher_q = teacher_feedback.get('questions', {}).get(str(q_num), {})
+            teacher_q = teacher_questions.get(str(q_num), _EMPTY)
             
             student_answer = q.get('student_answer', '')
             if student_answer == 'UNCLEAR' or q.get('needs_review'):
@@ -266,41 +603,32 @@ def generate_review_pdf(submission: dict, assignment: dict, student: dict, teach
             marks_total = teacher_q.get('marks_total') or q.get('marks_total', '?')
             
             # Status indicator
-            if q.get('is_correct') == True:
-                status = "✓"
-            elif q.get('is_correct') == False:
-                status = "✗"
+            is_correct = q.get('is_correct')
+            if is_correct == True:
+                status = _STATUS_OK
+            elif is_correct == False:
+                status = _STATUS_BAD
             else:
-                status = "?"
+                status = _STATUS_UNKNOWN
             
             row = [
-                Paragraph(f"<b>{q_num}</b><br/>{status}", styles['TableCell']),
-                Paragraph(truncate_text(student_answer, 100), styles['TableCell']),
-                Paragraph(truncate_text(correct_answer, 100), styles['TableCell']),
-                Paragraph(truncate_text(feedback, 150), styles['TableCell']),
-                Paragraph(f"<b>{marks}</b>/{marks_total}" if marks != '' else f"?/{marks_total}", styles['TableCell'])
+                # Plain string: styled by the table's column-0 commands, no markup to parse
+                f"{q_num}\n{status}",
+                Paragraph(truncate_text(student_answer, 100), cell_style),
+                Paragraph(truncate_text(correct_answer, 100), cell_style),
+                Paragraph(truncate_text(feedback, 150), cell_style),
+                f"{marks}/{marks_total}" if marks != '' else f"?/{marks_total}"
             ]
             table_data.append(row)
+            
+            # Areas for improvement are listed after the overall comments
+            improvement = q.get('improvement')
+            if improvement:
+                improvement_notes.append(f"Q{q_num}: {improvement}")
         
         # Create table
         feedback_table = Table(table_data, colWidths=[1.2*cm, 4*cm, 4*cm, 5*cm, 1.8*cm])
-        feedback_table.setStyle(TableStyle([
-            # Header row
-            ('BACKGROUND', (0, 0), (-1, 0), PRIMARY_COLOR),
-            ('TEXTCOLOR', (0, 0), (-1, 0), white),
-            # Alternating rows
-            ('BACKGROUND', (0, 1), (-1, -1), white),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [white, LIGHT_GRAY]),
-            # Borders
-            ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
-            ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
-            # Alignment
-            ('ALIGN', (0, 0), (0, -1), 'CENTER'),
-            ('ALIGN', (-1, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            # Padding
-            ('PADDING', (0, 0), (-1, -1), 6),
-        ]))
+        feedback_table.setStyle(_FEEDBACK_TABLE_STYLE)
         story.append(feedback_table)
     else:
         story.append(Paragraph("No detailed question feedback available.", styles['Body_Custom']))
@@ -315,19 +643,10 @@ def generate_review_pdf(submission: dict, assignment: dict, student: dict, teach
         # Create a styled box for overall feedback
         overall_data = [[Paragraph(overall, styles['Body_Custom'])]]
         overall_table = Table(overall_data, colWidths=[16*cm])
-        overall_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), HexColor('#e8f5e9')),
-            ('BOX', (0, 0), (-1, -1), 1, SUCCESS_COLOR),
-            ('PADDING', (0, 0), (-1, -1), 10),
-        ]))
+        overall_table.setStyle(_OVERALL_TABLE_STYLE)
         story.append(overall_table)
     
     # Areas for improvement
-    improvement_notes = []
-    for q in questions:
-        if q.get('improvement'):
-            improvement_notes.append(f"Q{q.get('question_num', '?')}: {q.get('improvement')}")
-    
     if improvement_notes:
         story.append(Spacer(1, 15))
         story.append(Paragraph("Areas for Improvement", styles['Heading_Custom']))
@@ -335,25 +654,12 @@ def generate_review_pdf(submission: dict, assignment: dict, student: dict, teach
             story.append(Paragraph(f"• {note}", styles['Body_Custom']))
     
     # Footer
-    story.append(Spacer(1, 30))
-    story.append(HRFlowable(width="100%", thickness=1, color=BORDER_COLOR))
-    story.append(Spacer(1, 5))
-    
-    teacher_name = teacher.get('name', 'Teacher') if teacher else 'Teacher'
-    footer_text = f"Reviewed by: {teacher_name} | Generated: {datetime.utcnow().strftime('%d %B %Y, %H:%M UTC')}"
-    story.append(Paragraph(footer_text, styles['Footer']))
+    _append_footer(story, teacher, styles, now)
     
     # Build PDF
     try:
         doc.build(story)
-        buffer.seek(0)
-        pdf_bytes = buffer.getvalue()
-
-        # Append marked copy pages for assessments
-        if marked_copy_files and len(marked_copy_files) > 0:
-            pdf_bytes = _merge_pdf_with_marked_copy(pdf_bytes, marked_copy_files)
-
-        return pdf_bytes
+        return _finish_output(buffer, output_stream, marked_copy_files)
     except Exception as e:
         logger.error(f"Error generating PDF: {e}")
         raise
@@ -363,7 +669,7 @@ def generate_feedback_pdf(submission: dict, assignment: dict, student: dict) ->
     return generate_review_pdf(submission, assignment, student)
 
 def generate_rubric_review_pdf(submission: dict, assignment: dict, student: dict, teacher: dict = None,
-                              marked_copy_files: list = None) -> bytes:
+                              marked_copy_files: list = None, output_stream: BinaryIO = None) -> Optional[bytes]:
     """
     Generate a comprehensive PDF feedback report for rubric-based essay marking
     
@@ -373,11 +679,12 @@ def generate_rubric_review_pdf(submission: dict, assignment: dict, student: dict
         student: The student document
         teacher: Optional teacher document
         marked_copy_files: Optional list of (content_type, bytes) for assessment marked copy pages
+        output_stream: Optional writable binary stream to write the PDF into
     
     Returns:
-        PDF content as bytes
+        PDF content as bytes, or None when written to output_stream
     """
-    buffer = io.BytesIO()
+    buffer = _output_buffer(output_stream, marked_copy_files)
     doc = SimpleDocTemplate(
         buffer,
         pagesize=A4,
@@ -388,6 +695,7 @@ def generate_rubric_review_pdf(submission: dict, assignment: dict, student: dict
     )
     
     styles = get_styles()
+    now = datetime.utcnow()
     story = []
     
     # Header with school info
@@ -395,50 +703,12 @@ def generate_rubric_review_pdf(submission: dict, assignment: dict, student: dict
     story.append(Spacer(1, 5))
     
     # Info box
-    info_data = [
-        ['Student:', student.get('name', 'Unknown'), 'Date:', datetime.utcnow().strftime('%d %B %Y')],
-        ['ID:', student.get('student_id', 'N/A'), 'Class:', student.get('class', 'N/A')],
-        ['Assignment:', assignment.get('title', 'Untitled'), 'Subject:', assignment.get('subject', 'N/A')],
-    ]
-    
-    info_table = Table(info_data, colWidths=[2*cm, 6*cm, 2*cm, 6*cm])
-    info_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('TEXTCOLOR', (0, 0), (-1, -1), TEXT_COLOR),
-        ('BACKGROUND', (0, 0), (-1, -1), LIGHT_GRAY),
-        ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
-        ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
-        ('PADDING', (0, 0), (-1, -1), 6),
-    ]))
-    story.append(info_table)
+    story.append(_build_info_table(student, assignment, now))
     story.append(Spacer(1, 15))
     
     # Score summary box
-    final_marks = submission.get('final_marks')
-    total_marks = assignment.get('total_marks', 100)
-    
-    if final_marks is not None:
-        percentage = (float(final_marks) / total_marks * 100) if total_marks > 0 else 0
-        grade = get_grade(percentage)
-        
-        score_data = [[
-            Paragraph(f"<b>Total Score</b>", styles['TableCell']),
-            Paragraph(f"<b>{final_marks} / {total_marks}</b>", styles['TableCell']),
-            Paragraph(f"<b>{percentage:.1f}%</b>", styles['TableCell']),
-            Paragraph(f"<b>Grade: {grade}</b>", styles['TableCell'])
-        ]]
-        
-        score_table = Table(score_data, colWidths=[4*cm, 4*cm, 4*cm, 4*cm])
-        score_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), PRIMARY_COLOR),
-            ('TEXTCOLOR', (0, 0), (-1, -1), white),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('PADDING', (0, 0), (-1, -1), 10),
-            ('BOX', (0, 0), (-1, -1), 2, PRIMARY_COLOR),
-        ]))
+    score_table = _build_score_table(submission.get('final_marks'), assignment.get('total_marks', 100), styles)
+    if score_table is not None:
         story.append(score_table)
         story.append(Spacer(1, 15))
     
@@ -450,20 +720,16 @@ def generate_rubric_review_pdf(submission: dict, assignment: dict, student: dict
     story.append(Paragraph("📋 Rubric Criteria Assessment", styles['Heading_Custom']))
     
     criteria = ai_feedback.get('criteria', [])
-    teacher_criteria = teacher_feedback.get('criteria', {})
+    teacher_criteria = teacher_feedback.get('criteria') or {}
     
     if criteria:
         # Table headers
-        criteria_data = [[
-            Paragraph('<b>Criterion</b>', styles['TableHeader']),
-            Paragraph('<b>AI Reasoning</b>', styles['TableHeader']),
-            Paragraph('<b>Feedback / AFI</b>', styles['TableHeader']),
-            Paragraph('<b>Marks</b>', styles['TableHeader'])
-        ]]
+        criteria_data = [list(_CRITERIA_HEADER_ROW)]
+        cell_style = styles['TableCell']
         
         for c in criteria:
             criterion_name = c.get('name', 'Unknown')
-            teacher_c = teacher_criteria.get(criterion_name, {})
+            teacher_c = teacher_criteria.get(criterion_name, _EMPTY)
             
             reasoning = teacher_c.get('reasoning') or c.get('reasoning', '')
             afi = teacher_c.get('afi') or c.get('afi', '')
@@ -471,25 +737,15 @@ def generate_rubric_review_pdf(submission: dict, assignment: dict, student: dict
             max_marks = teacher_c.get('max_marks') or c.get('max_marks', 10)
             
             row = [
-                Paragraph(f"<b>{criterion_name}</b>", styles['TableCell']),
-                Paragraph(truncate_text(reasoning, 120), styles['TableCell']),
-                Paragraph(truncate_text(afi, 120), styles['TableCell']),
-                Paragraph(f"<b>{marks}</b>/{max_marks}" if marks != '' else f"?/{max_marks}", styles['TableCell'])
+                Paragraph(f"<b>{criterion_name}</b>", cell_style),
+                Paragraph(truncate_text(reasoning, 120), cell_style),
+                Paragraph(truncate_text(afi, 120), cell_style),
+                f"{marks}/{max_marks}" if marks != '' else f"?/{max_marks}"
             ]
             criteria_data.append(row)
         
         criteria_table = Table(criteria_data, colWidths=[3*cm, 5*cm, 5.5*cm, 2.5*cm])
-        criteria_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), PRIMARY_COLOR),
-            ('TEXTCOLOR', (0, 0), (-1, 0), white),
-            ('BACKGROUND', (0, 1), (-1, -1), white),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [white, LIGHT_GRAY]),
-            ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
-            ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
-            ('ALIGN', (-1, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('PADDING', (0, 0), (-1, -1), 6),
-        ]))
+        criteria_table.setStyle(_CRITERIA_TABLE_STYLE)
         story.append(criteria_table)
     else:
         story.append(Paragraph("No rubric criteria assessment available.", styles['Body_Custom']))
@@ -503,11 +759,7 @@ def generate_rubric_review_pdf(submission: dict, assignment: dict, student: dict
         
         overall_data = [[Paragraph(overall, styles['Body_Custom'])]]
         overall_table = Table(overall_data, colWidths=[16*cm])
-        overall_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, -1), HexColor('#e8f5e9')),
-            ('BOX', (0, 0), (-1, -1), 1, SUCCESS_COLOR),
-            ('PADDING', (0, 0), (-1, -1), 10),
-        ]))
+        overall_table.setStyle(_OVERALL_TABLE_STYLE)
         story.append(overall_table)
         story.append(Spacer(1, 15))
     
@@ -517,62 +769,37 @@ def generate_rubric_review_pdf(submission: dict, assignment: dict, student: dict
     errors = teacher_feedback.get('errors', []) or ai_feedback.get('errors', [])
     
     if errors:
-        error_data = [[
-            Paragraph('<b>Location</b>', styles['TableHeader']),
-            Paragraph('<b>Error</b>', styles['TableHeader']),
-            Paragraph('<b>Suggested Correction</b>', styles['TableHeader']),
-            Paragraph('<b>Feedback</b>', styles['TableHeader'])
-        ]]
+        error_data = [list(_ERROR_HEADER_ROW)]
+        cell_style = styles['TableCell']
         
         for e in errors:
             row = [
-                Paragraph(e.get('location', 'N/A'), styles['TableCell']),
-                Paragraph(truncate_text(e.get('error', ''), 80), styles['TableCell']),
-                Paragraph(truncate_text(e.get('correction', ''), 80), styles['TableCell']),
-                Paragraph(truncate_text(e.get('feedback', ''), 80), styles['TableCell'])
+                Paragraph(e.get('location', 'N/A'), cell_style),
+                Paragraph(truncate_text(e.get('error', ''), 80), cell_style),
+                Paragraph(truncate_text(e.get('correction', ''), 80), cell_style),
+                Paragraph(truncate_text(e.get('feedback', ''), 80), cell_style)
             ]
             error_data.append(row)
         
         error_table = Table(error_data, colWidths=[2.5*cm, 4.5*cm, 4.5*cm, 4.5*cm])
-        error_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), WARNING_COLOR),
-            ('TEXTCOLOR', (0, 0), (-1, 0), black),
-            ('BACKGROUND', (0, 1), (-1, -1), white),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [white, HexColor('#fff9e6')]),
-            ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
-            ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('PADDING', (0, 0), (-1, -1), 6),
-        ]))
+        error_table.setStyle(_ERROR_TABLE_STYLE)
         story.append(error_table)
     else:
         story.append(Paragraph("No specific errors or corrections noted. Well done!", styles['Body_Custom']))
     
     # Footer
-    story.append(Spacer(1, 30))
-    story.append(HRFlowable(width="100%", thickness=1, color=BORDER_COLOR))
-    story.append(Spacer(1, 5))
-    
-    teacher_name = teacher.get('name', 'Teacher') if teacher else 'Teacher'
-    footer_text = f"Reviewed by: {teacher_name} | Generated: {datetime.utcnow().strftime('%d %B %Y, %H:%M UTC')}"
-    story.append(Paragraph(footer_text, styles['Footer']))
+    _append_footer(story, teacher, styles, now)
     
     # Build PDF
     try:
         doc.build(story)
-        buffer.seek(0)
-        pdf_bytes = buffer.getvalue()
-
-        # Append marked copy pages for assessments
-        if marked_copy_files and len(marked_copy_files) > 0:
-            pdf_bytes = _merge_pdf_with_marked_copy(pdf_bytes, marked_copy_files)
-
-        return pdf_bytes
+        return _finish_output(buffer, output_stream, marked_copy_files)
     except Exception as e:
         logger.error(f"Error generating rubric PDF: {e}")
         raise
 
-def generate_class_report_pdf(assignment: dict, submissions: list, students_map: dict, teacher: dict = None) -> bytes:
+def generate_class_report_pdf(assignment: dict, submissions: list, students_map: dict, teacher: dict = None,
+                              output_stream: BinaryIO = None) -> Optional[bytes]:
     """
     Generate a comprehensive class report for an assignment
     
@@ -581,11 +808,12 @@ def generate_class_report_pdf(assignment: dict, submissions: list, students_map:
         submissions: List of all submissions
         students_map: Dictionary mapping student_id to student document
         teacher: Teacher document
+        output_stream: Optional writable binary stream to write the PDF into
     
     Returns:
-        PDF content as bytes
+        PDF content as bytes, or None when written to output_stream
     """
-    buffer = io.BytesIO()
+    buffer = _output_buffer(output_stream)
     doc = SimpleDocTemplate(
         buffer,
         pagesize=A4,
@@ -596,6 +824,7 @@ def generate_class_report_pdf(assignment: dict, submissions: list, students_map:
     )
     
     styles = get_styles()
+    now = datetime.utcnow()
     story = []
     
     # Ensure total_marks is a float for arithmetic operations
@@ -616,106 +845,79 @@ def generate_class_report_pdf(assignment: dict, submissions: list, students_map:
     info_data = [
         ['Assignment:', assignment.get('title', 'Untitled'), 'Subject:', assignment.get('subject', 'N/A')],
         ['Teacher:', teacher.get('name', 'N/A') if teacher else 'N/A', 'Total Marks:', str(total_marks)],
-        ['Date:', datetime.utcnow().strftime('%d %B %Y'), 'Students:', str(total_students)]
+        ['Date:', now.strftime(DATE_FORMAT), 'Students:', str(total_students)]
     ]
     
     info_table = Table(info_data, colWidths=[2.5*cm, 5.5*cm, 2.5*cm, 5.5*cm])
-    info_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('BACKGROUND', (0, 0), (-1, -1), LIGHT_GRAY),
-        ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
-        ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
-        ('PADDING', (0, 0), (-1, -1), 6),
-    ]))
+    info_table.setStyle(_CLASS_INFO_TABLE_STYLE)
     story.append(info_table)
     story.append(Spacer(1, 20))
     
-    # Calculate statistics - convert final_marks to float safely
-    scores = []
+    # Calculate statistics and score distribution in one pass (final_marks converted to float safely)
+    distribution = [0, 0, 0, 0]  # counts per _DIST_LABELS bucket
+    scored_count = 0
+    total_score = 0.0
+    min_score = float('inf')
+    max_score = float('-inf')
+    pass_count = 0
+    reviewed_count = 0
+    pass_mark = total_marks * 0.5
     for s in submissions:
+        if s.get('status') == 'reviewed':
+            reviewed_count += 1
         fm = s.get('final_marks')
-        if fm is not None:
-            try:
-                scores.append(float(fm))
-            except (ValueError, TypeError):
-                pass  # Skip invalid values
-    
-    reviewed_count = len([s for s in submissions if s.get('status') == 'reviewed'])
+        if fm is None:
+            continue
+        try:
+            score = float(fm)
+        except (ValueError, TypeError):
+            continue  # Skip invalid values
+        scored_count += 1
+        total_score += score
+        if score < min_score:
+            min_score = score
+        if score > max_score:
+            max_score = score
+        if score >= pass_mark:
+            pass_count += 1
+        pct = (score / total_marks * 100) if total_marks > 0 else 0
+        distribution[0 if pct >= 80 else 1 if pct >= 60 else 2 if pct >= 40 else 3] += 1
     
-    if scores:
-        avg_score = sum(scores) / len(scores)
-        min_score = min(scores)
-        max_score = max(scores)
-        pass_count = len([s for s in scores if s >= float(total_marks) * 0.5])
-        pass_rate = pass_count / len(scores) * 100
+    if scored_count:
+        avg_score = total_score / scored_count
+        pass_rate = pass_count / scored_count * 100
     else:
         avg_score = min_score = max_score = pass_rate = 0
-        pass_count = 0
     
     # Stats summary
     story.append(Paragraph("📈 Performance Summary", styles['Heading_Custom']))
     
     stats_data = [
-        ['Metric', 'Value', 'Metric', 'Value'],
+        list(_STATS_HEADER_ROW),
         ['Submissions', f'{len(submissions)}/{total_students}', 'Reviewed', str(reviewed_count)],
         ['Average Score', f'{avg_score:.1f}/{total_marks:.0f} ({avg_score/total_marks*100:.0f}%)' if total_marks > 0 else 'N/A', 
          'Pass Rate', f'{pass_rate:.0f}%'],
-        ['Highest', f'{max_score:.1f}/{total_marks:.0f}' if scores else 'N/A',
-         'Lowest', f'{min_score:.1f}/{total_marks:.0f}' if scores else 'N/A']
+        ['Highest', f'{max_score:.1f}/{total_marks:.0f}' if scored_count else 'N/A',
+         'Lowest', f'{min_score:.1f}/{total_marks:.0f}' if scored_count else 'N/A']
     ]
     
     stats_table = Table(stats_data, colWidths=[4*cm, 4*cm, 4*cm, 4*cm])
-    stats_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), PRIMARY_COLOR),
-        ('TEXTCOLOR', (0, 0), (-1, 0), white),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTNAME', (0, 1), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (2, 1), (2, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('ALIGN', (1, 0), (1, -1), 'CENTER'),
-        ('ALIGN', (3, 0), (3, -1), 'CENTER'),
-        ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
-        ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
-        ('PADDING', (0, 0), (-1, -1), 8),
-    ]))
+    stats_table.setStyle(_STATS_TABLE_STYLE)
     story.append(stats_table)
     story.append(Spacer(1, 20))
     
     # Score distribution
     story.append(Paragraph("📊 Score Distribution", styles['Heading_Custom']))
     
-    distribution = {'A (80-100%)': 0, 'B (60-79%)': 0, 'C (40-59%)': 0, 'D (0-39%)': 0}
-    for score in scores:
-        pct = (score / total_marks * 100) if total_marks > 0 else 0
-        if pct >= 80:
-            distribution['A (80-100%)'] += 1
-        elif pct >= 60:
-            distribution['B (60-79%)'] += 1
-        elif pct >= 40:
-            distribution['C (40-59%)'] += 1
-        else:
-            distribution['D (0-39%)'] += 1
-    
-    dist_data = [['Grade', 'Count', 'Percentage']]
-    colors = {'A': SUCCESS_COLOR, 'B': HexColor('#17a2b8'), 'C': WARNING_COLOR, 'D': DANGER_COLOR}
-    
-    for grade, count in distribution.items():
-        pct = (count / len(scores) * 100) if scores else 0
+    dist_data = [list(_DIST_HEADER_ROW)]
+    colors = {'A': SUCCESS_COLOR, 'B': GRADE_B_COLOR, 'C': WARNING_COLOR, 'D': DANGER_COLOR}
+    
+    for grade, count in zip(_DIST_LABELS, distribution):
+        pct = (count / scored_count * 100) if scored_count else 0
         dist_data.append([grade, str(count), f'{pct:.0f}%'])
     
     dist_table = Table(dist_data, colWidths=[5*cm, 3*cm, 3*cm])
-    dist_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), PRIMARY_COLOR),
-        ('TEXTCOLOR', (0, 0), (-1, 0), white),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
-        ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
-        ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
-        ('PADDING', (0, 0), (-1, -1), 6),
-    ]))
+    dist_table.setStyle(_DIST_TABLE_STYLE)
     story.append(dist_table)
     story.append(Spacer(1, 20))
     
@@ -727,13 +929,13 @@ def generate_class_report_pdf(assignment: dict, submissions: list, students_map:
         
         if strengths:
             story.append(Paragraph("<b>✅ Areas of Strength:</b>", styles['Body_Custom']))
-            for s in strengths[:5]:
+            for s in strengths:
                 story.append(Paragraph(f"• Question {s['q']}: {s['correct']}/{s['total']} correct ({s['pct']:.0f}%)", styles['Body_Custom']))
             story.append(Spacer(1, 10))
         
         if improvements:
             story.append(Paragraph("<b>⚠️ Areas Needing Attention:</b>", styles['Body_Custom']))
-            for i in improvements[:5]:
+            for i in improvements:
                 story.append(Paragraph(f"• Question {i['q']}: {i['incorrect']}/{i['total']} need improvement ({i['pct']:.0f}%)", styles['Body_Custom']))
     
     # ==================== PAGE 2: STUDENT LIST ====================
@@ -742,9 +944,14 @@ def generate_class_report_pdf(assignment: dict, submissions: list, students_map:
     story.append(Spacer(1, 10))
     
     # Sort submissions by score (highest first), then by name
-    sorted_submissions = []
+    # Index submissions by student once (first submission wins, as before) instead of rescanning per student
+    sub_by_sid = {}
+    for s in submissions:
+        sub_by_sid.setdefault(s['student_id'], s)
+    
+    entries = []
     for student_id, student in students_map.items():
-        sub = next((s for s in submissions if s['student_id'] == student_id), None)
+        sub = sub_by_sid.get(student_id)
         # Convert final_marks to float for proper sorting
         score = None
         if sub and sub.get('final_marks') is not None:
@@ -752,133 +959,108 @@ def generate_class_report_pdf(assignment: dict, submissions: list, students_map:
                 score = float(sub['final_marks'])
             except (ValueError, TypeError):
                 score = None
-        sorted_submissions.append({
-            'student': student,
-            'submission': sub,
-            'score': score
-        })
+        # Decorated with its sort key: scored students first, highest score first
+        sort_key = (True, 0) if score is None else (False, -score)
+        entries.append((sort_key, score, student, sub))
     
-    sorted_submissions.sort(key=lambda x: (x['score'] is None, -(x['score'] or 0)))
+    entries.sort(key=itemgetter(0))
     
-    # Student results table
-    student_data = [['#', 'Student Name', 'Class', 'Status', 'Score', 'Grade']]
-    
-    for idx, item in enumerate(sorted_submissions, 1):
-        student = item['student']
-        sub = item['submission']
-        
-        name = student.get('name', 'Unknown')[:25]
-        cls = student.get('class', 'N/A')
-        
-        if sub:
-            if sub['status'] == 'reviewed':
-                status = 'Reviewed'
-            elif sub['status'] == 'ai_reviewed':
-                status = 'AI Reviewed'
-            else:
-                status = 'Pending'
-            
-            if sub.get('final_marks') is not None:
-                try:
-                    marks = float(sub['final_marks'])
-                    score = f"{marks:.1f}/{total_marks:.0f}"
-                    pct = (marks / total_marks * 100) if total_marks > 0 else 0
-                    grade = get_grade(pct)
-                except (ValueError, TypeError):
-                    score = '-'
-                    grade = '-'
-            else:
-                score = '-'
-                grade = '-'
-        else:
-            status = 'Not Submitted'
-            score = '-'
-            grade = '-'
-        
-        student_data.append([str(idx), name, cls, status, score, grade])
-    
-    # Create table (split if too many students)
-    student_table = Table(student_data, colWidths=[1*cm, 5*cm, 2*cm, 3*cm, 2.5*cm, 2*cm])
-    student_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), PRIMARY_COLOR),
-        ('TEXTCOLOR', (0, 0), (-1, 0), white),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 8),
-        ('ALIGN', (0, 0), (0, -1), 'CENTER'),
-        ('ALIGN', (3, 0), (-1, -1), 'CENTER'),
-        ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
-        ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [white, LIGHT_GRAY]),
-        ('PADDING', (0, 0), (-1, -1), 4),
-    ]))
-    story.append(student_table)
+    # One page-sized table per chunk with fixed row heights, so ReportLab never
+    # has to measure and split one huge table. Rows are built chunk by chunk
+    # rather than held for the whole class at once.
+    for start in range(0, len(entries) or 1, STUDENT_ROWS_PER_TABLE):
+        if start:
+            story.append(PageBreak())
+        student_data = [_STUDENT_HEADER_ROW]
+        for idx, (_, score, student, sub) in enumerate(entries[start:start + STUDENT_ROWS_PER_TABLE], start + 1):
+            student_data.append(_student_result_row(idx, score, student, sub, total_marks))
+        student_table = Table(student_data, colWidths=[1*cm, 5*cm, 2*cm, 3*cm, 2.5*cm, 2*cm],
+                              rowHeights=[STUDENT_ROW_HEIGHT] * len(student_data))
+        student_table.setStyle(_STUDENT_TABLE_STYLE)
+        story.append(student_table)
     
     # Footer
     story.append(Spacer(1, 30))
     story.append(HRFlowable(width="100%", thickness=1, color=BORDER_COLOR))
     story.append(Spacer(1, 5))
     story.append(Paragraph(
-        f"Generated: {datetime.utcnow().strftime('%d %B %Y, %H:%M UTC')} | Teacher: {teacher.get('name', 'N/A') if teacher else 'N/A'}",
+        f"Generated: {now.strftime(TIMESTAMP_FORMAT)} | Teacher: {teacher.get('name', 'N/A') if teacher else 'N/A'}",
         styles['Footer']
     ))
     
     try:
         doc.build(story)
-        buffer.seek(0)
-        return buffer.getvalue()
+        return _finish_output(buffer, output_stream)
     except Exception as e:
         logger.error(f"Error generating class report: {e}")
         raise
 
-def analyze_feedback_patterns(submissions: list) -> tuple:
-    """Analyze submission feedback to find patterns"""
-    question_stats = {}
+def _student_result_row(idx: int, score, student: dict, sub: dict, total_marks: float) -> tuple:
+    """One row of the class report student table; score is the parsed final_marks or None"""
+    name = student.get('name', 'Unknown')[:25]
+    cls = student.get('class', 'N/A')
+    
+    if not sub:
+        return (str(idx), name, cls, 'Not Submitted', '-', '-')
+    
+    if sub['status'] == 'reviewed':
+        status = 'Reviewed'
+    elif sub['status'] == 'ai_reviewed':
+        status = 'AI Reviewed'
+    else:
+        status = 'Pending'
+    
+    if score is None:
+        return (str(idx), name, cls, status, '-', '-')
+    
+    pct = (score / total_marks * 100) if total_marks > 0 else 0
+    return (str(idx), name, cls, status, f"{score:.1f}/{total_marks:.0f}", get_grade(pct))
+
+def analyze_feedback_patterns(submissions: list, top_k: int = 5) -> tuple:
+    """Analyze submission feedback to find patterns (top_k strongest/weakest questions each)"""
+    # q_num -> [correct, incorrect, total]
+    question_stats = defaultdict(lambda: [0, 0, 0])
     
     for sub in submissions:
         ai_feedback = sub.get('ai_feedback', {})
-        questions = ai_feedback.get('questions', [])
         
-        for q in questions:
-            q_num = q.get('question_num', 0)
-            if q_num not in question_stats:
-                question_stats[q_num] = {'correct': 0, 'incorrect': 0, 'total': 0}
-            
-            question_stats[q_num]['total'] += 1
-            if q.get('is_correct') == True:
-                question_stats[q_num]['correct'] += 1
-            elif q.get('is_correct') == False:
-                question_stats[q_num]['incorrect'] += 1
+        for q in ai_feedback.get('questions', []):
+            st = question_stats[q.get('question_num', 0)]
+            st[2] += 1
+            is_correct = q.get('is_correct')
+            if is_correct == True:
+                st[0] += 1
+            elif is_correct == False:
+                st[1] += 1
     
     strengths = []
     improvements = []
     
-    for q_num, stats in question_stats.items():
-        if stats['total'] > 0:
-            correct_pct = stats['correct'] / stats['total'] * 100
-            incorrect_pct = stats['incorrect'] / stats['total'] * 100
-            
-            if correct_pct >= 70:
-                strengths.append({
-                    'q': q_num,
-                    'correct': stats['correct'],
-                    'total': stats['total'],
-                    'pct': correct_pct
-                })
-            
-            if incorrect_pct >= 50:
-                improvements.append({
-                    'q': q_num,
-                    'incorrect': stats['incorrect'],
-                    'total': stats['total'],
-                    'pct': incorrect_pct
-                })
-    
-    strengths.sort(key=lambda x: -x['pct'])
-    improvements.sort(key=lambda x: -x['pct'])
-    
-    return strengths, improvements
+    for q_num, (correct, incorrect, total) in question_stats.items():
+        correct_pct = correct / total * 100
+        incorrect_pct = incorrect / total * 100
+        
+        if correct_pct >= 70:
+            strengths.append({
+                'q': q_num,
+                'correct': correct,
+                'total': total,
+                'pct': correct_pct
+            })
+        
+        if incorrect_pct >= 50:
+            improvements.append({
+                'q': q_num,
+                'incorrect': incorrect,
+                'total': total,
+                'pct': incorrect_pct
+            })
+    
+    pct_key = itemgetter('pct')
+    return heapq.nlargest(top_k, strengths, key=pct_key), heapq.nlargest(top_k, improvements, key=pct_key)
 
-def generate_batch_feedback_pdf(submissions: list, assignment: dict, students_map: dict, teacher: dict = None) -> bytes:
+def generate_batch_feedback_pdf(submissions: list, assignment: dict, students_map: dict, teacher: dict = None,
+                                output_stream: BinaryIO = None) -> Optional[bytes]:
     """
     Generate a batch PDF with feedback for multiple students
     
@@ -887,11 +1069,12 @@ def generate_batch_feedback_pdf(submissions: list, assignment: dict, students_ma
         assignment: The assignment document
         students_map: Dictionary mapping student_id to student document
         teacher: Optional teacher document
+        output_stream: Optional writable binary stream to write the PDF into
     
     Returns:
-        PDF content as bytes
+        PDF content as bytes, or None when written to output_stream
     """
-    buffer = io.BytesIO()
+    buffer = _output_buffer(output_stream)
     doc = SimpleDocTemplate(
         buffer,
         pagesize=A4,
@@ -911,12 +1094,11 @@ def generate_batch_feedback_pdf(submissions: list, assignment: dict, students_ma
         student = students_map.get(submission.get('student_id'), {})
         
         # Add individual feedback page
-        story.extend(generate_student_feedback_elements(submission, assignment, student, teacher, styles))
+        _append_student_feedback(story, submission, assignment, student, teacher, styles)
     
     try:
         doc.build(story)
-        buffer.seek(0)
-        return buffer.getvalue()
+        return _finish_output(buffer, output_stream)
     except Exception as e:
         logger.error(f"Error generating batch PDF: {e}")
         raise
@@ -924,14 +1106,19 @@ def generate_batch_feedback_pdf(submissions: list, assignment: dict, students_ma
 def generate_student_feedback_elements(submission: dict, assignment: dict, student: dict, teacher: dict, styles) -> list:
     """Generate story elements for a single student's feedback"""
     elements = []
+    _append_student_feedback(elements, submission, assignment, student, teacher, styles)
+    return elements
+
+def _append_student_feedback(story: list, submission: dict, assignment: dict, student: dict, teacher: dict, styles):
+    """Append a single student's feedback elements straight onto story"""
     
     # Header
-    elements.append(Paragraph(f"Feedback: {assignment.get('title', 'Assignment')}", styles['Title_Custom']))
+    story.append(Paragraph(f"Feedback: {assignment.get('title', 'Assignment')}", styles['Title_Custom']))
     
     # Student info
     info_text = f"<b>Student:</b> {student.get('name', 'Unknown')} ({student.get('student_id', 'N/A')}) | <b>Class:</b> {student.get('class', 'N/A')}"
-    elements.append(Paragraph(info_text, styles['Body_Custom']))
-    elements.append(Spacer(1, 10))
+    story.append(Paragraph(info_text, styles['Body_Custom']))
+    story.append(Spacer(1, 10))
     
     # Score
     final_marks = submission.get('final_marks')
@@ -952,9 +1139,9 @@ def generate_student_feedback_elements(submission: dict, assignment: dict, stude
     
     if final_marks is not None:
         percentage = (float(final_marks) / float(total_marks) * 100) if total_marks > 0 else 0
-        elements.append(Paragraph(f"<b>Score: {final_marks}/{total_marks} ({percentage:.1f}%)</b>", styles['Heading_Custom']))
+        story.append(Paragraph(f"<b>Score: {final_marks}/{total_marks} ({percentage:.1f}%)</b>", styles['Heading_Custom']))
     
-    elements.append(Spacer(1, 10))
+    story.append(Spacer(1, 10))
     
     # Feedback table (simplified for batch)
     ai_feedback = submission.get('ai_feedback', {})
@@ -963,46 +1150,39 @@ def generate_student_feedback_elements(submission: dict, assignment: dict, stude
     
     if questions:
         table_data = [['Q#', 'Status', 'Marks', 'Feedback']]
+        teacher_questions = teacher_feedback.get('questions') or {}
+        teacher_qs = [teacher_questions.get(str(q.get('question_num', '')), _EMPTY) for q in questions]
+        feedbacks = _truncate_many(
+            [teacher_q.get('feedback', q.get('feedback', '')) for q, teacher_q in zip(questions, teacher_qs)], 80
+        )
         
-        for q in questions:
-            teacher_q = teacher_feedback.get('questions', {}).get(str(q.get('question_num', '')), {})
-            
-            status = "✓" if q.get('is_correct') else "✗" if q.get('is_correct') == False else "?"
+        for q, teacher_q, feedback in zip(questions, teacher_qs, feedbacks):
+            status = _STATUS_OK if q.get('is_correct') else _STATUS_BAD if q.get('is_correct') == False else _STATUS_UNKNOWN
             marks = teacher_q.get('marks', q.get('marks_awarded', '?'))
             marks_total = q.get('marks_total', '?')
-            feedback = teacher_q.get('feedback', q.get('feedback', ''))
             
             table_data.append([
                 str(q.get('question_num', '?')),
                 status,
                 f"{marks}/{marks_total}",
-                truncate_text(feedback, 80)
+                feedback
             ])
         
         table = Table(table_data, colWidths=[1*cm, 1.5*cm, 2*cm, 11.5*cm])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), PRIMARY_COLOR),
-            ('TEXTCOLOR', (0, 0), (-1, 0), white),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 8),
-            ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
-            ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
-            ('ALIGN', (0, 0), (2, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-            ('PADDING', (0, 0), (-1, -1), 4),
-        ]))
-        elements.append(table)
+        table.setStyle(_BATCH_FEEDBACK_TABLE_STYLE)
+        story.append(table)
     
     # Overall feedback
     overall = teacher_feedback.get('overall_feedback') or ai_feedback.get('overall_feedback', '')
     if overall:
-        elements.append(Spacer(1, 10))
-        elements.append(Paragraph(f"<b>Comments:</b> {overall}", styles['Body_Custom']))
-    
-    return elements
+        story.append(Spacer(1, 10))
+        story.append(Paragraph(f"<b>Comments:</b> {overall}", styles['Body_Custom']))
 
 def truncate_text(text: str, max_length: int) -> str:
     """Truncate text to max length with ellipsis"""
+    # Fast path: most cells are short strings that pass through unchanged
+    if type(text) is str and len(text) <= max_length:
+        return text
     if not text:
         return ''
     text = str(text)
@@ -1010,47 +1190,38 @@ def truncate_text(text: str, max_length: int) -> str:
         return text
     return text[:max_length-3] + '...'
 
+def _truncate_many(texts: list, max_length: int) -> list:
+    """truncate_text over a whole column; short strings pass through without a call per cell"""
+    return [t if type(t) is str and len(t) <= max_length else truncate_text(t, max_length) for t in texts]
+
+# Lower bound (inclusive) of each grade above F, and the grade for each band
+_GRADE_CUTS = (45, 50, 55, 60, 65, 70, 75, 80, 85, 90)
+_GRADE_NAMES = ('F', 'D', 'C-', 'C', 'C+', 'B-', 'B', 'B+', 'A-', 'A', 'A+')
+
 def get_grade(percentage: float) -> str:
     """Convert percentage to letter grade"""
-    if percentage >= 90:
-        return 'A+'
-    elif percentage >= 85:
-        return 'A'
-    elif percentage >= 80:
-        return 'A-'
-    elif percentage >= 75:
-        return 'B+'
-    elif percentage >= 70:
-        return 'B'
-    elif percentage >= 65:
-        return 'B-'
-    elif percentage >= 60:
-        return 'C+'
-    elif percentage >= 55:
-        return 'C'
-    elif percentage >= 50:
-        return 'C-'
-    elif percentage >= 45:
-        return 'D'
-    else:
+    if percentage != percentage:  # NaN falls through every comparison, like the old if-chain
         return 'F'
+    return _GRADE_NAMES[bisect_right(_GRADE_CUTS, percentage)]
 
-def generate_submission_pdf(pages: list, submission_id: str) -> bytes:
+def generate_submission_pdf(pages: list, submission_id: str, output_stream: BinaryIO = None) -> Optional[bytes]:
     """
     Generate a PDF from submission images.
     
     Args:
         pages: List of page dictionaries with 'type' and 'data' keys
         submission_id: The submission ID for reference
+        output_stream: Optional writable binary stream to write the PDF into
     
     Returns:
-        PDF content as bytes, or None if failed
+        PDF content as bytes, or None if failed (always None when written to output_stream;
+        failures are logged)
     """
-    from PIL import Image
-    from reportlab.lib.utils import ImageReader
+    # Pillow stays a lazy import like elsewhere in the app; ReportLab's Image is the module-level import
+    from PIL import Image as PILImage
     
     try:
-        buffer = io.BytesIO()
+        buffer = _output_buffer(output_stream)
         doc = SimpleDocTemplate(
             buffer,
             pagesize=A4,
@@ -1072,13 +1243,9 @@ def generate_submission_pdf(pages: list, submission_id: str) -> bytes:
                 story.append(PageBreak())
             
             if page['type'] == 'image':
-                # Convert image bytes to PIL Image
+                # Open lazily: format, mode and size come from the header without decoding pixels
                 img_buffer = io.BytesIO(page['data'])
-                img = Image.open(img_buffer)
-                
-                # Convert to RGB if necessary (for JPEG compatibility)
-                if img.mode in ('RGBA', 'P'):
-                    img = img.convert('RGB')
+                img = PILImage.open(img_buffer)
                 
                 # Calculate dimensions to fit page
                 page_width = A4[0] - 1*cm  # Account for margins
@@ -1097,14 +1264,44 @@ def generate_submission_pdf(pages: list, submission_id: str) -> bytes:
                     display_height = page_height
                     display_width = page_height / aspect
                 
-                # Save resized image to buffer
-                img_output = io.BytesIO()
-                img.save(img_output, format='JPEG', quality=85)
-                img_output.seek(0)
+                # Pixels needed to print at SUBMISSION_IMAGE_DPI (display size is in points)
+                target_size = (max(1, int(display_width / 72 * SUBMISSION_IMAGE_DPI)),
+                               max(1, int(display_height / 72 * SUBMISSION_IMAGE_DPI)))
+                
+                if (img.format == 'JPEG' and img.mode in ('RGB', 'L')
+                        and img_width <= target_size[0] and img_height <= target_size[1]):
+                    # JPEG already at print size: ReportLab embeds the bytes as-is
+                    img_output = io.BytesIO(page['data'])
+                else:
+                    if img.format == 'JPEG':
+                        # Let libjpeg decode at a reduced scale (1/2, 1/4 or 1/8) no smaller than the target
+                        img.draft(img.mode, target_size)
+                    
+                    # Palette images must be expanded first (Pillow only resizes them with NEAREST)
+                    if img.mode == 'P':
+                        img = img.convert('RGB')
+                    
+                    # Shrink before any other conversion so it only touches output pixels;
+                    # reducing_gap lets Pillow take integer box-filter reduce() steps before
+                    # the final LANCZOS pass
+                    img.thumbnail(target_size, PILImage.LANCZOS, reducing_gap=2.0)
+                    
+                    # Convert to RGB if necessary (for JPEG compatibility)
+                    if img.mode == 'RGBA':
+                        img = img.convert('RGB')
+                    
+                    # Re-encode as a plain baseline JPEG. Deliberately lossy for speed: 4:2:0 chroma
+                    # subsampling and no Huffman optimisation pass; fine for photos of written work
+                    img_output = io.BytesIO()
+                    img.save(img_output, format='JPEG', quality=SUBMISSION_JPEG_QUALITY,
+                             optimize=False, progressive=False, subsampling=2)
+                    img_output.seek(0)
+                    
+                    # Free the decoded bitmap now rather than holding it until the next page
+                    img.close()
                 
                 # Create image for ReportLab
-                from reportlab.platypus import Image as RLImage
-                rl_image = RLImage(img_output, width=display_width, height=display_height)
+                rl_image = Image(img_output, width=display_width, height=display_height)
                 story.append(rl_image)
                 
             elif page['type'] == 'pdf':
@@ -1113,8 +1310,7 @@ def generate_submission_pdf(pages: list, submission_id: str) -> bytes:
                 story.append(Paragraph(f"Page {i+1}: PDF document (see original files)", styles['Body_Custom']))
         
         doc.build(story)
-        buffer.seek(0)
-        return buffer.getvalue()
+        return _finish_output(buffer, output_stream)
         
     except Exception as e:
         logger.error(f"Error generating submission PDF: {e}")
@@ -1141,15 +1337,19 @@ def generate_assignment_pdf(assignment: dict, teacher: dict = None) -> bytes:
     # Title
     story.append(Paragraph(assignment.get('title', 'Assignment'), styles['Title_Custom']))
     
-    # Info
-    story.append(Paragraph(f"Subject: {assignment.get('subject', 'N/A')}", styles['Body_Custom']))
-    story.append(Paragraph(f"Total Marks: {assignment.get('total_marks', 0)}", styles['Body_Custom']))
+    # Info (one paragraph, one line per field)
+    info_lines = [
+        f"Subject: {assignment.get('subject', 'N/A')}",
+        f"Total Marks: {assignment.get('total_marks', 0)}",
+    ]
     
     if assignment.get('due_date'):
         due_date = assignment['due_date']
         if isinstance(due_date, datetime):
-            due_date = due_date.strftime('%d %B %Y')
-        story.append(Paragraph(f"Due Date: {due_date}", styles['Body_Custom']))
+            due_date = due_date.strftime(DATE_FORMAT)
+        info_lines.append(f"Due Date: {due_date}")
+    
+    story.append(Paragraph('<br/>'.join(info_lines), styles['Body_Custom']))
     
     story.append(Spacer(1, 20))
     story.append(HRFlowable(width="100%", thickness=2, color=PRIMARY_COLOR))
@@ -1163,17 +1363,12 @@ def generate_assignment_pdf(assignment: dict, teacher: dict = None) -> bytes:
     
     # Questions
     story.append(Paragraph("Questions", styles['Heading_Custom']))
+    q_style = styles['Question']
     
     for i, q in enumerate(assignment.get('questions', []), 1):
         question_text = q.get('question', q.get('text', ''))
         marks = q.get('marks', 0)
         
-        q_style = ParagraphStyle(
-            'Question',
-            parent=styles['Body_Custom'],
-            fontName='Helvetica-Bold',
-            spaceBefore=15
-        )
         story.append(Paragraph(f"Q{i}. {question_text} [{marks} marks]", q_style))
         story.append(Spacer(1, 30))  # Space for answer
     
@@ -1211,6 +1406,7 @@ def generate_class_student_list_pdf(class_id: str, class_name: str, students: li
     )
     
     styles = get_styles()
+    now = datetime.utcnow()
     story = []
     
     # Title
@@ -1222,20 +1418,11 @@ def generate_class_student_list_pdf(class_id: str, class_name: str, students: li
     # Info box
     info_data = [
         ['Class:', class_id, 'Total Students:', str(len(students))],
-        ['Generated:', datetime.utcnow().strftime('%d %B %Y'), 'Teacher:', teacher.get('name', 'N/A') if teacher else 'N/A'],
+        ['Generated:', now.strftime(DATE_FORMAT), 'Teacher:', teacher.get('name', 'N/A') if teacher else 'N/A'],
     ]
     
     info_table = Table(info_data, colWidths=[2.5*cm, 5.5*cm, 3*cm, 5*cm])
-    info_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (2, 0), (2, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('TEXTCOLOR', (0, 0), (-1, -1), TEXT_COLOR),
-        ('BACKGROUND', (0, 0), (-1, -1), LIGHT_GRAY),
-        ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
-        ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
-        ('PADDING', (0, 0), (-1, -1), 6),
-    ]))
+    info_table.setStyle(_CLASS_LIST_INFO_TABLE_STYLE)
     story.append(info_table)
     story.append(Spacer(1, 20))
     
@@ -1256,27 +1443,10 @@ def generate_class_student_list_pdf(class_id: str, class_name: str, students: li
             student.get('name', 'Unknown')
         ])
     
-    # Create table
-    student_table = Table(table_data, colWidths=[1.5*cm, 4*cm, 10.5*cm])
-    student_table.setStyle(TableStyle([
-        # Header row
-        ('BACKGROUND', (0, 0), (-1, 0), PRIMARY_COLOR),
-        ('TEXTCOLOR', (0, 0), (-1, 0), white),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        # Data rows
-        ('FONTSIZE', (0, 1), (-1, -1), 10),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [white, LIGHT_GRAY]),
-        # Borders
-        ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
-        ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
-        # Alignment
-        ('ALIGN', (0, 0), (0, -1), 'CENTER'),
-        ('ALIGN', (1, 0), (1, -1), 'CENTER'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        # Padding
-        ('PADDING', (0, 0), (-1, -1), 8),
-    ]))
+    # Create table (single-line rows, so heights are fixed up front)
+    student_table = Table(table_data, colWidths=[1.5*cm, 4*cm, 10.5*cm],
+                          rowHeights=[SINGLE_LINE_ROW_HEIGHT] * len(table_data))
+    student_table.setStyle(_CLASS_LIST_TABLE_STYLE)
     story.append(student_table)
     
     # Footer
@@ -1284,7 +1454,7 @@ def generate_class_student_list_pdf(class_id: str, class_name: str, students: li
     story.append(HRFlowable(width="100%", thickness=1, color=BORDER_COLOR))
     story.append(Spacer(1, 5))
     story.append(Paragraph(
-        f"Generated: {datetime.utcnow().strftime('%d %B %Y, %H:%M UTC')} | This list contains Student ID and Name only - no passwords included",
+        f"Generated: {now.strftime(TIMESTAMP_FORMAT)} | This list contains Student ID and Name only - no passwords included",
         styles['Footer']
     ))
     
@@ -1319,6 +1489,7 @@ def generate_duplicate_report_pdf(duplicates: list, resolved_mappings: list = No
     )
     
     styles = get_styles()
+    now = datetime.utcnow()
     story = []
     
     # Title
@@ -1329,7 +1500,7 @@ def generate_duplicate_report_pdf(duplicates: list, resolved_mappings: list = No
     total_duplicates = sum(len(group) for group in duplicates)
     story.append(Paragraph(f"Total duplicate entries found: {total_duplicates}", styles['Body_Custom']))
     story.append(Paragraph(f"Number of duplicate name groups: {len(duplicates)}", styles['Body_Custom']))
-    story.append(Paragraph(f"Generated: {datetime.utcnow().strftime('%d %B %Y, %H:%M UTC')}", styles['Body_Custom']))
+    story.append(Paragraph(f"Generated: {now.strftime(TIMESTAMP_FORMAT)}", styles['Body_Custom']))
     story.append(Spacer(1, 15))
     
     if not duplicates:
@@ -1366,19 +1537,7 @@ def generate_duplicate_report_pdf(duplicates: list, resolved_mappings: list = No
                 ])
             
             group_table = Table(table_data, colWidths=[3*cm, 4.5*cm, 2*cm, 4*cm, 2.5*cm])
-            group_table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), PRIMARY_COLOR),
-                ('TEXTCOLOR', (0, 0), (-1, 0), white),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, -1), 8),
-                ('ROWBACKGROUNDS', (0, 1), (-1, -1), [white, LIGHT_GRAY]),
-                ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
-                ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
-                ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-                ('PADDING', (0, 0), (-1, -1), 5),
-                # Highlight the "KEEP" row
-                ('BACKGROUND', (-1, 1), (-1, 1), HexColor('#d4edda')),
-            ]))
+            group_table.setStyle(_DUPLICATE_GROUP_TABLE_STYLE)
             story.append(group_table)
             story.append(Spacer(1, 15))
     
@@ -1401,18 +1560,7 @@ def generate_duplicate_report_pdf(duplicates: list, resolved_mappings: list = No
             ])
         
         mapping_table = Table(mapping_data, colWidths=[6*cm, 5*cm, 5*cm])
-        mapping_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), SUCCESS_COLOR),
-            ('TEXTCOLOR', (0, 0), (-1, 0), white),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 9),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [white, HexColor('#d4edda')]),
-            ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
-            ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
-            ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('PADDING', (0, 0), (-1, -1), 6),
-        ]))
+        mapping_table.setStyle(_MAPPING_TABLE_STYLE)
         story.append(mapping_table)
     
     # Footer
@@ -1420,7 +1568,7 @@ def generate_duplicate_report_pdf(duplicates: list, resolved_mappings: list = No
     story.append(HRFlowable(width="100%", thickness=1, color=BORDER_COLOR))
     story.append(Spacer(1, 5))
     story.append(Paragraph(
-        f"Generated: {datetime.utcnow().strftime('%d %B %Y, %H:%M UTC')}",
+        f"Generated: {now.strftime(TIMESTAMP_FORMAT)}",
         styles['Footer']
     ))
     
@@ -1455,6 +1603,7 @@ def generate_affected_teachers_report_pdf(affected_teachers: list, resolved_mapp
     )
     
     styles = get_styles()
+    now = datetime.utcnow()
     story = []
     
     # Title
@@ -1487,22 +1636,7 @@ def generate_affected_teachers_report_pdf(affected_teachers: list, resolved_mapp
         ])
     
     update_table = Table(table_data, colWidths=[5*cm, 3.5*cm, 4*cm, 3.5*cm])
-    update_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), PRIMARY_COLOR),
-        ('TEXTCOLOR', (0, 0), (-1, 0), white),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [white, LIGHT_GRAY]),
-        ('BOX', (0, 0), (-1, -1), 1, BORDER_COLOR),
-        ('GRID', (0, 0), (-1, -1), 0.5, BORDER_COLOR),
-        ('ALIGN', (1, 0), (2, -1), 'CENTER'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('PADDING', (0, 0), (-1, -1), 6),
-        # Highlight the kept ID column
-        ('BACKGROUND', (1, 1), (1, -1), HexColor('#d4edda')),
-        # Strikethrough effect for old IDs
-        ('TEXTCOLOR', (2, 1), (2, -1), HexColor('#999999')),
-    ]))
+    update_table.setStyle(_ID_UPDATE_TABLE_STYLE)
     story.append(update_table)
     
     # Important note
@@ -1513,11 +1647,7 @@ def generate_affected_teachers_report_pdf(affected_teachers: list, resolved_mapp
         styles['Body_Custom']
     )]]
     note_table = Table(note_data, colWidths=[16*cm])
-    note_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, -1), HexColor('#fff3cd')),
-        ('BOX', (0, 0), (-1, -1), 1, WARNING_COLOR),
-        ('PADDING', (0, 0), (-1, -1), 10),
-    ]))
+    note_table.setStyle(_NOTE_TABLE_STYLE)
     story.append(note_table)
     
     # Footer
@@ -1525,7 +1655,7 @@ def generate_affected_teachers_report_pdf(affected_teachers: list, resolved_mapp
     story.append(HRFlowable(width="100%", thickness=1, color=BORDER_COLOR))
     story.append(Spacer(1, 5))
     story.append(Paragraph(
-        f"Generated: {datetime.utcnow().strftime('%d %B %Y, %H:%M UTC')}",
+        f"Generated: {now.strftime(TIMESTAMP_FORMAT)}",
         styles['Footer']
     ))
     
@@ -1550,6 +1680,7 @@ def generate_heatmap_pdf(assignment: dict, report: dict, teacher: dict = None) -
         bottomMargin=1.5*cm
     )
     styles = get_styles()
+    now = datetime.utcnow()
     story = []
 
     story.append(Paragraph("Feedback &amp; Summary Report", styles['Title_Custom']))
@@ -1639,7 +1770,7 @@ def generate_heatmap_pdf(assignment: dict, report: dict, teacher: dict = None) -
         story.append(Paragraph("Green: 100% | Yellow: 50–99% | Red: &lt;50% | Gray: no data", styles['Body_Custom']))
 
     story.append(Spacer(1, 20))
-    story.append(Paragraph(f"Generated: {datetime.utcnow().strftime('%d %B %Y, %H:%M UTC')}", styles['Footer']))
+    story.append(Paragraph(f"Generated: {now.strftime(TIMESTAMP_FORMAT)}", styles['Footer']))
 
     try:
         doc.build(story)
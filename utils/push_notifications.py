@@ -8,6 +8,8 @@ Students must subscribe via their browser/PWA to receive notifications.
 import os
 import json
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pywebpush import webpush, WebPushException
 
 logger = logging.getLogger(__name__)
@@ -20,6 +22,9 @@ VAPID_CLAIMS = {
     "sub": os.getenv('VAPID_EMAIL', 'mailto:admin@school.edu')
 }
 
+# Max concurrent webpush requests when notifying a whole class
+PUSH_CONCURRENCY = int(os.getenv('PUSH_CONCURRENCY', '32'))
+
 
 def get_vapid_public_key() -> str:
     """Return the VAPID public key for client-side subscription"""
@@ -147,6 +152,7 @@ def send_assignment_notification(db, assignment: dict, class_id: str = None,
     
     results = {"sent": 0, "failed": 0, "expired": 0}
     expired_subscriptions = []
+    pending = []
     
     for student in students:
         subscription = student.get('push_subscription')
@@ -160,22 +166,34 @@ def send_assignment_notification(db, assignment: dict, class_id: str = None,
             except:
                 continue
         
-        result = send_push_notification(
-            subscription_info=subscription,
-            title=title,
-            body=body,
-            url=url,
-            tag=tag
-        )
-        
-        if result is True:
-            results["sent"] += 1
-        elif result is None:
-            # Subscription expired
-            results["expired"] += 1
-            expired_subscriptions.append(student['student_id'])
-        else:
-            results["failed"] += 1
+        pending.append((student['student_id'], subscription))
+    
+    if pending:
+        # Each send is a blocking HTTPS round-trip, so fan them out
+        with ThreadPoolExecutor(max_workers=min(PUSH_CONCURRENCY, len(pending))) as executor:
+            futures = {
+                executor.submit(
+                    send_push_notification,
+                    subscription_info=subscription,
+                    title=title,
+                    body=body,
+                    url=url,
+                    tag=tag
+                ): student_id
+                for student_id, subscription in pending
+            }
+            
+            for future in as_completed(futures):
+                result = future.result()
+                
+                if result is True:
+                    results["sent"] += 1
+                elif result is None:
+                    # Subscription expired
+                    results["expired"] += 1
+                    expired_subscriptions.append(futures[future])
+                else:
+                    results["failed"] += 1
     
     # Clean up expired subscriptions
     if expired_subscriptions:
@@ -189,6 +207,37 @@ def send_assignment_notification(db, assignment: dict, class_id: str = None,
     return results
 
 
+def send_assignment_notification_async(db, assignment: dict, class_id: str = None,
+                                        teaching_group_id: str = None) -> threading.Thread:
+    """
+    Run send_assignment_notification on a background thread.
+    
+    Lets request handlers return immediately instead of waiting on every
+    subscriber's push round-trip. Results are logged, not returned.
+    
+    Returns:
+        The started daemon thread
+    """
+    def _run():
+        try:
+            send_assignment_notification(
+                db=db,
+                assignment=assignment,
+                class_id=class_id,
+                teaching_group_id=teaching_group_id
+            )
+        except Exception as e:
+            logger.error(f"Background assignment notification failed: {e}")
+    
+    thread = threading.Thread(
+        target=_run,
+        name=f"push-assignment-{assignment.get('assignment_id')}",
+        daemon=True
+    )
+    thread.start()
+    return thread
+
+
 def send_feedback_notification(db, student_id: str, assignment: dict, 
                                 submission: dict) -> bool:
     """
@@ -9,35 +9,68 @@ and ANTHROPIC_API_KEY is set (better for scanned PDFs, images, tables).
 """
 
 import base64
+import csv
+import functools
 import gc
 import json
 import multiprocessing
 import os
 import re
 import io
+import itertools
 import logging
+import threading
 import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
 from typing import Optional, List, Dict, Any, Tuple
 
+from cachetools import TTLCache
+
 logger = logging.getLogger(__name__)
 
 # Chunking defaults (smaller = less memory on Railway's limited RAM)
 CHUNK_SIZE = 600
 CHUNK_OVERLAP = 100
 MAX_CHUNKS_QUERY = 5
-INGEST_BATCH_SIZE = int(os.getenv("RAG_INGEST_BATCH_SIZE", "10"))  # Batch size for OpenAI embedding calls
+INGEST_BATCH_SIZE = int(os.getenv("RAG_INGEST_BATCH_SIZE", "100"))  # Batch size for OpenAI embedding calls
+EMBEDDING_CONCURRENCY = int(os.getenv("RAG_EMBEDDING_CONCURRENCY", "8"))  # Embedding requests in flight
 RAG_MAX_PAGES = int(os.getenv("RAG_MAX_PAGES", "60"))  # Max pages per PDF upload
 
 # OpenAI embedding model (1536 dimensions)
 EMBEDDING_MODEL = "text-embedding-3-small"
 EMBEDDING_DIMENSION = 1536
+# Column type for stored embeddings: "halfvec" (FP16, half the disk/index size) or "vector" (FP32).
+# halfvec needs pgvector >= 0.7; older servers fall back to vector.
+EMBEDDING_STORAGE = os.getenv("RAG_EMBEDDING_STORAGE", "halfvec").strip().lower()
+# Two-stage search: Hamming-distance ANN over binary-quantized embeddings, then exact cosine rerank.
+# Off by default — per-module textbooks are small enough for the exact HNSW index; enable for large corpora.
+BINARY_QUANTIZED_SEARCH = os.getenv("RAG_BINARY_QUANTIZED_SEARCH", "").strip().lower() in ("1", "true", "yes")
+BINARY_SEARCH_CANDIDATES = int(os.getenv("RAG_BINARY_SEARCH_CANDIDATES", "100"))
+HNSW_MAX_EF_SEARCH = 1000  # pgvector's upper bound for hnsw.ef_search
 
 # Anthropic Vision: max pages per upload to limit cost/latency
 MAX_PAGES_ANTHROPIC_VISION = int(os.getenv("RAG_VISION_MAX_PAGES", "40"))
+VISION_CONCURRENCY = int(os.getenv("RAG_VISION_CONCURRENCY", "4"))  # Claude requests in flight
+VISION_PAGES_PER_REQUEST = int(os.getenv("RAG_VISION_PAGES_PER_REQUEST", "4"))  # Page images per Claude request
+VISION_MAX_RETRIES = 5  # SDK retries 429/5xx with exponential backoff
 
 # Table and schema
 RAG_TABLE = "rag_embeddings"
 
+# Shared connection pool for request-path queries (ingest uses its own connections)
+PG_POOL_MAX_CONN = int(os.getenv("RAG_PG_POOL_MAX_CONN", "16"))
+_pg_pool = None
+_pg_pool_lock = threading.Lock()
+
+# query_textbook caches: (namespace, query, limit) -> chunks, and query text -> embedding
+QUERY_CACHE_TTL = float(os.getenv("RAG_QUERY_CACHE_TTL", "300"))
+EMBEDDING_CACHE_TTL = float(os.getenv("RAG_EMBEDDING_CACHE_TTL", "3600"))
+_query_cache = TTLCache(maxsize=2048, ttl=QUERY_CACHE_TTL)
+_embedding_cache = TTLCache(maxsize=4096, ttl=EMBEDDING_CACHE_TTL)
+_has_content_cache = TTLCache(maxsize=1024, ttl=60)  # namespace -> bool
+_query_cache_lock = threading.Lock()
+
 
 def _log_memory_usage(label: str = ""):
     """Log current memory usage (helps debug OOM on Railway)."""
@@ -90,30 +123,153 @@ def _get_pg_conn():
         return None
 
 
+def _get_pg_pool():
+    """Return the shared ThreadedConnectionPool, creating it on first use, or None."""
+    global _pg_pool
+    if _pg_pool is not None:
+        return _pg_pool
+    url = _get_pgvector_url()
+    if not url:
+        return None
+    with _pg_pool_lock:
+        if _pg_pool is None:
+            try:
+                from psycopg2.extensions import connection
+                from psycopg2.pool import ThreadedConnectionPool
+
+                class _PooledConnection(connection):
+                    """Connection that remembers whether pgvector is set up on it."""
+                    vector_ready = False
+
+                _pg_pool = ThreadedConnectionPool(
+                    1, PG_POOL_MAX_CONN, url, connection_factory=_PooledConnection
+                )
+            except ImportError as e:
+                logger.warning("pgvector or psycopg2 not installed: %s", e)
+                return None
+            except Exception as e:
+                logger.warning("Could not connect to pgvector: %s", e)
+                return None
+    return _pg_pool
+
+
+def _prepare_pooled_conn(conn) -> None:
+    """Enable the vector extension and register the type once per pooled connection."""
+    from pgvector.psycopg2 import register_vector
+
+    conn.autocommit = True  # CREATE EXTENSION requires autocommit
+    cur = conn.cursor()
+    cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    cur.close()
+    conn.autocommit = False
+    register_vector(conn)
+    conn.vector_ready = True
+
+
+@contextmanager
+def _pg_conn():
+    """Check a connection out of the pool for the duration of a with-block.
+    
+    Yields None when pgvector is not configured or reachable. Falls back to a
+    one-off connection if the pool is exhausted.
+    """
+    pool = _get_pg_pool()
+    if pool is None:
+        yield None
+        return
+    
+    conn = None
+    pooled = True
+    try:
+        conn = pool.getconn()
+        if not conn.vector_ready:
+            _prepare_pooled_conn(conn)
+    except Exception as e:
+        logger.warning("Could not check out pooled pgvector connection: %s", e)
+        if conn is not None:
+            pool.putconn(conn, close=True)
+        pooled = False
+        conn = _get_pg_conn()
+    
+    try:
+        yield conn
+    finally:
+        if conn is not None:
+            if pooled:
+                try:
+                    if not conn.closed:
+                        conn.rollback()  # Never hand back a connection mid-transaction
+                except Exception:
+                    pass
+                pool.putconn(conn, close=bool(conn.closed))
+            else:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+
 def _ensure_table(conn) -> bool:
-    """Create rag_embeddings table and enable extension if needed."""
+    """Create rag_embeddings table and enable extension if needed.
+    Migrates an existing FP32 embedding column to halfvec when EMBEDDING_STORAGE asks for it."""
     try:
         cur = conn.cursor()
         cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
+        vector_type = "vector"
+        if EMBEDDING_STORAGE == "halfvec":
+            cur.execute("SELECT 1 FROM pg_type WHERE typname = 'halfvec'")
+            if cur.fetchone():
+                vector_type = "halfvec"
+            else:
+                logger.warning("pgvector on this server has no halfvec type; storing embeddings as vector")
         cur.execute(f"""
             CREATE TABLE IF NOT EXISTS {RAG_TABLE} (
                 id UUID PRIMARY KEY,
                 namespace VARCHAR(255) NOT NULL,
-                embedding vector({EMBEDDING_DIMENSION}) NOT NULL,
+                embedding {vector_type}({EMBEDDING_DIMENSION}) NOT NULL,
                 content TEXT NOT NULL,
                 metadata JSONB
             )
         """)
+        cur.execute(
+            "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+            "WHERE attrelid = %s::regclass AND attname = 'embedding'",
+            (RAG_TABLE,),
+        )
+        column_type = cur.fetchone()[0]
+        if vector_type == "halfvec" and column_type.startswith("vector"):
+            # The HNSW index is tied to vector_cosine_ops, so rebuild it after the type change
+            logger.info("Migrating %s.embedding from %s to halfvec", RAG_TABLE, column_type)
+            cur.execute("DROP INDEX IF EXISTS idx_rag_embedding")
+            cur.execute(f"""
+                ALTER TABLE {RAG_TABLE}
+                ALTER COLUMN embedding TYPE halfvec({EMBEDDING_DIMENSION})
+                USING embedding::halfvec({EMBEDDING_DIMENSION})
+            """)
+            column_type = "halfvec"
+        cosine_ops = "halfvec_cosine_ops" if column_type.startswith("halfvec") else "vector_cosine_ops"
         cur.execute(f"""
             CREATE INDEX IF NOT EXISTS idx_rag_namespace ON {RAG_TABLE} (namespace)
         """)
+        cur.execute("SAVEPOINT rag_hnsw_index")
         try:
             cur.execute(f"""
                 CREATE INDEX IF NOT EXISTS idx_rag_embedding ON {RAG_TABLE}
-                USING hnsw (embedding vector_cosine_ops)
+                USING hnsw (embedding {cosine_ops})
             """)
         except Exception as idx_err:
+            cur.execute("ROLLBACK TO SAVEPOINT rag_hnsw_index")
             logger.warning("Could not create HNSW index (queries will still work): %s", idx_err)
+        if BINARY_QUANTIZED_SEARCH:
+            cur.execute("SAVEPOINT rag_bit_index")
+            try:
+                cur.execute(f"""
+                    CREATE INDEX IF NOT EXISTS idx_rag_embedding_bit ON {RAG_TABLE}
+                    USING hnsw ((binary_quantize(embedding)::bit({EMBEDDING_DIMENSION})) bit_hamming_ops)
+                """)
+            except Exception as idx_err:
+                cur.execute("ROLLBACK TO SAVEPOINT rag_bit_index")
+                logger.warning("Could not create binary-quantized HNSW index: %s", idx_err)
         conn.commit()
         cur.close()
         return True
@@ -123,6 +279,18 @@ def _ensure_table(conn) -> bool:
         return False
 
 
+def _insert_chunk_rows(cur, rows: List[Tuple[str, str, str, str, str]]) -> None:
+    """Bulk-load (id, namespace, embedding literal, content, metadata) rows with COPY."""
+    buf = io.StringIO()
+    # QUOTE_ALL so an empty value is loaded as '' rather than NULL
+    csv.writer(buf, quoting=csv.QUOTE_ALL, lineterminator="\n").writerows(rows)
+    buf.seek(0)
+    cur.copy_expert(
+        f"COPY {RAG_TABLE} (id, namespace, embedding, content, metadata) FROM STDIN WITH (FORMAT csv)",
+        buf,
+    )
+
+
 def _namespace_name(module_id: str) -> str:
     """Namespace for a module's textbook. Sanitize for safe use."""
     safe = re.sub(r"[^a-zA-Z0-9_-]", "_", module_id)
@@ -166,8 +334,9 @@ def _extract_text_from_pdf(pdf_bytes: bytes) -> str:
         return ""
 
 
+@functools.lru_cache(maxsize=1)
 def _get_anthropic_client():
-    """Return Anthropic client if API key is available."""
+    """Return the shared Anthropic client if API key is available."""
     api_key = os.getenv("ANTHROPIC_API_KEY", "").strip()
     if not api_key:
         return None
@@ -179,9 +348,93 @@ def _get_anthropic_client():
         return None
 
 
+def _prepare_page_jpeg(img, resample) -> str:
+    """Downscale a rendered page and return it as base64 JPEG for Claude Vision."""
+    w, h = img.size
+    max_dim = 1400
+    if w > max_dim or h > max_dim:
+        ratio = min(max_dim / w, max_dim / h)
+        img = img.resize((int(w * ratio), int(h * ratio)), resample)
+    if img.mode in ("RGBA", "P"):
+        img = img.convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=80)
+    del img
+    return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+
+_VISION_PAGE_MARKER = re.compile(r"^--- Page (\d+) ---[ \t]*$", re.MULTILINE)
+
+
+def _claude_ocr(client, pages: List[Tuple[int, str]]) -> Dict[int, str]:
+    """Ask Claude Vision for the text of one or more pages in a single request.
+    
+    pages is a list of (page number, base64 JPEG). Returns {page number: text};
+    pages that failed or came back empty are left out.
+    """
+    page_numbers = [page for page, _ in pages]
+    content = [
+        {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": "image/jpeg",
+                "data": b64,
+            },
+        }
+        for _, b64 in pages
+    ]
+    prompt = "Extract all text from this page of a textbook or document. Preserve paragraphs and structure. Output plain text only, no markdown or headings. If the page is mostly images or diagrams, describe them briefly in text."
+    if len(pages) > 1:
+        prompt = (
+            f"These {len(pages)} images are consecutive pages of a textbook or document, "
+            f"pages {', '.join(str(p) for p in page_numbers)}. "
+            "Extract all text from each page. Start each page's text with a line of the form "
+            "'--- Page N ---' using those page numbers, in order. Preserve paragraphs and structure. "
+            "Output plain text only, no markdown or headings. If a page is mostly images or diagrams, "
+            "describe them briefly in text."
+        )
+    content.append({"type": "text", "text": prompt})
+    try:
+        resp = client.messages.create(
+            model="claude-sonnet-4-5-20250929",
+            max_tokens=4096 * len(pages),
+            messages=[{"role": "user", "content": content}],
+        )
+        text = (resp.content[0].text if resp.content else "").strip()
+    except Exception as e:
+        logger.warning("Anthropic Vision extraction failed for pages %s: %s", page_numbers, e)
+        return {}
+    if not text:
+        return {}
+    if len(pages) == 1:
+        return {page_numbers[0]: text}
+    
+    # Split the reply on the page markers we asked for
+    markers = list(_VISION_PAGE_MARKER.finditer(text))
+    if not markers:
+        logger.warning("Vision reply for pages %s had no page markers; keeping it as page %s", page_numbers, page_numbers[0])
+        return {page_numbers[0]: text}
+    texts = {}
+    # Text before the first marker belongs to the first page (Claude sometimes omits its marker)
+    preamble = text[:markers[0].start()].strip()
+    if preamble:
+        texts[page_numbers[0]] = preamble
+    for i, marker in enumerate(markers):
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(text)
+        page_text = text[marker.end():end].strip()
+        if page_text:
+            page = int(marker.group(1))
+            if page not in page_numbers:
+                page = page_numbers[min(i, len(page_numbers) - 1)]
+            texts[page] = f"{texts[page]}\n\n{page_text}" if page in texts else page_text
+    return texts
+
+
 def _extract_text_from_pdf_via_anthropic(pdf_bytes: bytes) -> str:
     """Extract text from PDF using Anthropic Vision (PDF → images → Claude).
-    Better for scanned PDFs, images, tables. Processes one page at a time to avoid OOM."""
+    Better for scanned PDFs, images, tables. Renders VISION_PAGES_PER_REQUEST pages at a
+    time, sends them to Claude in one request, and keeps up to VISION_CONCURRENCY requests in flight."""
     client = _get_anthropic_client()
     if not client:
         return ""
@@ -191,64 +444,47 @@ def _extract_text_from_pdf_via_anthropic(pdf_bytes: bytes) -> str:
     except ImportError:
         logger.warning("pdf2image or PIL not available for Anthropic Vision extraction")
         return ""
+    client = client.with_options(max_retries=VISION_MAX_RETRIES)
     max_pages = min(MAX_PAGES_ANTHROPIC_VISION, 100)
-    parts = []
-    for page_one_indexed in range(1, max_pages + 1):
-        try:
-            images = convert_from_bytes(
-                pdf_bytes,
-                first_page=page_one_indexed,
-                last_page=page_one_indexed,
-                dpi=100,
-            )
-        except Exception as e:
-            if page_one_indexed == 1:
-                logger.error("Error converting PDF to images for Vision: %s", e)
-            break
-        if not images:
-            break
-        img = images[0]
-        del images
-        w, h = img.size
-        max_dim = 1400
-        if w > max_dim or h > max_dim:
-            ratio = min(max_dim / w, max_dim / h)
-            img = img.resize((int(w * ratio), int(h * ratio)), Image.LANCZOS)
-        if img.mode in ("RGBA", "P"):
-            img = img.convert("RGB")
-        buf = io.BytesIO()
-        img.save(buf, format="JPEG", quality=80)
-        del img
-        buf.seek(0)
-        b64 = base64.b64encode(buf.read()).decode("utf-8")
-        del buf
-        try:
-            resp = client.messages.create(
-                model="claude-sonnet-4-5-20250929",
-                max_tokens=4096,
-                messages=[{
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/jpeg",
-                                "data": b64,
-                            },
-                        },
-                        {
-                            "type": "text",
-                            "text": "Extract all text from this page of a textbook or document. Preserve paragraphs and structure. Output plain text only, no markdown or headings. If the page is mostly images or diagrams, describe them briefly in text.",
-                        },
-                    ],
-                }],
-            )
-            text = (resp.content[0].text if resp.content else "").strip()
-            if text:
-                parts.append(f"--- Page {page_one_indexed} ---\n{text}")
-        except Exception as e:
-            logger.warning("Anthropic Vision extraction failed for page %s: %s", page_one_indexed, e)
+    pages_per_request = max(1, VISION_PAGES_PER_REQUEST)
+    concurrency = max(1, VISION_CONCURRENCY)
+    texts = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = set()
+        for first_page in range(1, max_pages + 1, pages_per_request):
+            # Render the next group only once a request slot frees up, so at most
+            # VISION_CONCURRENCY groups of encoded pages are held in memory
+            while len(pending) >= concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    texts.update(future.result())
+            last_page = min(first_page + pages_per_request - 1, max_pages)
+            try:
+                images = convert_from_bytes(
+                    pdf_bytes,
+                    first_page=first_page,
+                    last_page=last_page,
+                    dpi=100,
+                )
+            except Exception as e:
+                if first_page == 1:
+                    logger.error("Error converting PDF to images for Vision: %s", e)
+                break
+            if not images:
+                break
+            reached_end = len(images) < last_page - first_page + 1
+            pages = [
+                (first_page + offset, _prepare_page_jpeg(img, Image.LANCZOS))
+                for offset, img in enumerate(images)
+            ]
+            del images
+            pending.add(executor.submit(_claude_ocr, client, pages))
+            del pages
+            if reached_end:
+                break
+        for future in as_completed(pending):
+            texts.update(future.result())
+    parts = [f"--- Page {page} ---\n{texts[page]}" for page in sorted(texts)]
     return "\n\n".join(parts) if parts else ""
 
 
@@ -276,8 +512,10 @@ def _chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OV
     return [c for c in chunks if c]
 
 
+@functools.lru_cache(maxsize=1)
 def _get_openai_client():
-    """Return OpenAI client if API key is available."""
+    """Return the shared OpenAI client if API key is available.
+    Reusing it keeps the SDK's HTTP connections alive between queries."""
     api_key = os.getenv("OPENAI_API_KEY", "").strip()
     if not api_key:
         return None
@@ -289,6 +527,12 @@ def _get_openai_client():
         return None
 
 
+# Ingest workers are forked; don't let them reuse the parent's open HTTP sockets
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_get_openai_client.cache_clear)
+    os.register_at_fork(after_in_child=_get_anthropic_client.cache_clear)
+
+
 def _get_embeddings(texts: List[str], openai_client) -> List[List[float]]:
     """Get embeddings for a list of texts using OpenAI."""
     if not texts:
@@ -304,6 +548,27 @@ def _get_embeddings(texts: List[str], openai_client) -> List[List[float]]:
         return []
 
 
+def _get_query_embedding(text: str, openai_client) -> Optional[List[float]]:
+    """Embedding for a query string, served from the cache when the same text recurs."""
+    with _query_cache_lock:
+        cached = _embedding_cache.get(text)
+    if cached is not None:
+        return cached
+    embeddings = _get_embeddings([text], openai_client)
+    if not embeddings:
+        return None
+    with _query_cache_lock:
+        _embedding_cache[text] = embeddings[0]
+    return embeddings[0]
+
+
+def _invalidate_query_cache(namespace: str) -> None:
+    """Drop cached query results for a namespace after its content changes."""
+    with _query_cache_lock:
+        _has_content_cache.pop(namespace, None)
+        for key in [key for key in _query_cache if key[0] == namespace]:
+            _query_cache.pop(key, None)
+
 def _pgvector_not_available_message() -> str:
     """User-facing message when pgvector is not configured."""
     return (
@@ -379,6 +644,7 @@ def ingest_textbook(
     logger.info(f"=== Starting textbook ingest (PDF) in subprocess: {len(pdf_bytes)} bytes ===")
     _log_memory_usage("Before subprocess")
     result = _run_in_subprocess(_ingest_textbook_worker, (module_id, pdf_bytes, title, append))
+    _invalidate_query_cache(_namespace_name(module_id))
     del pdf_bytes
     gc.collect()
     _log_memory_usage("After subprocess")
@@ -399,6 +665,7 @@ def ingest_text_content(
         return {"success": False, "error": "Text is too short (need at least 100 characters)."}
     _log_memory_usage("Before text ingest subprocess")
     result = _run_in_subprocess(_ingest_text_worker, (module_id, text, title, append))
+    _invalidate_query_cache(_namespace_name(module_id))
     del text
     gc.collect()
     _log_memory_usage("After text ingest subprocess")
@@ -451,43 +718,60 @@ def _ingest_text_content_impl(
         batch_size = INGEST_BATCH_SIZE
         total_upserted = 0
 
-        for start in range(0, total_chunks, batch_size):
-            end = min(start + batch_size, total_chunks)
-            batch_chunks = chunks[start:end]
-            
-            embeddings = _get_embeddings(batch_chunks, openai_client)
-            if not embeddings or len(embeddings) != len(batch_chunks):
-                cur.close()
-                conn.close()
-                return {"success": False, "error": "Failed to generate embeddings for chunks."}
-            
-            for i, (chunk, embedding) in enumerate(zip(batch_chunks, embeddings)):
-                meta = {
-                    "page_chunk": start + i + 1,
-                    "total_chunks": total_chunks,
-                    "upload_title": upload_title,
-                }
-                # Pass embedding as pgvector string literal — avoids importing numpy (~30-40 MB)
-                emb_str = "[" + ",".join(str(v) for v in embedding) + "]"
-                cur.execute(
-                    f"""
-                    INSERT INTO {RAG_TABLE} (id, namespace, embedding, content, metadata)
-                    VALUES (%s, %s, %s::vector, %s, %s)
-                    """,
-                    (
-                        str(uuid.uuid4()),
-                        namespace,
-                        emb_str,
-                        chunk,
-                        json.dumps(meta),
-                    ),
-                )
-                total_upserted += 1
-            
-            conn.commit()  # Commit each batch to release memory
-            logger.info(f"Ingested batch {start}-{end} of {total_chunks} chunks ({total_upserted} total)")
-            del batch_chunks, embeddings
-            gc.collect()
+        # Embedding calls are blocking HTTPS round-trips, so keep several batches
+        # in flight and insert each one as soon as its embeddings come back. The
+        # window is bounded so only a few batches of embeddings are alive at once.
+        max_in_flight = max(1, EMBEDDING_CONCURRENCY)
+        executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        try:
+            batch_starts = iter(range(0, total_chunks, batch_size))
+            in_flight = {}
+            while True:
+                for start in itertools.islice(batch_starts, max_in_flight - len(in_flight)):
+                    future = executor.submit(_get_embeddings, chunks[start:start + batch_size], openai_client)
+                    in_flight[future] = start
+                if not in_flight:
+                    break
+                
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start = in_flight.pop(future)
+                    end = min(start + batch_size, total_chunks)
+                    batch_chunks = chunks[start:end]
+                    
+                    embeddings = future.result()
+                    if not embeddings or len(embeddings) != len(batch_chunks):
+                        conn.rollback()
+                        cur.close()
+                        conn.close()
+                        return {"success": False, "error": "Failed to generate embeddings for chunks."}
+                    
+                    # Pass embeddings as pgvector string literals — avoids importing numpy (~30-40 MB)
+                    rows = [
+                        (
+                            str(uuid.uuid4()),
+                            namespace,
+                            "[" + ",".join(str(v) for v in embedding) + "]",
+                            chunk,
+                            json.dumps({
+                                "page_chunk": start + i + 1,
+                                "total_chunks": total_chunks,
+                                "upload_title": upload_title,
+                            }),
+                        )
+                        for i, (chunk, embedding) in enumerate(zip(batch_chunks, embeddings))
+                    ]
+                    _insert_chunk_rows(cur, rows)
+                    total_upserted += len(rows)
+                    del rows
+                    
+                    conn.commit()  # Commit each batch to release memory
+                    logger.info(f"Ingested batch {start}-{end} of {total_chunks} chunks ({total_upserted} total)")
+                    del batch_chunks, embeddings
+                del done, future
+                gc.collect()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
 
         # Free chunks list before final query
         del chunks
@@ -551,6 +835,7 @@ def ingest_precomputed_embeddings(
 
         for start in range(0, total_items, batch_size):
             end = min(start + batch_size, total_items)
+            rows = []
             for i in range(start, end):
                 item = items[i]
                 text = item.get("text", "").strip()
@@ -563,20 +848,10 @@ def ingest_precomputed_embeddings(
                     "upload_title": upload_title,
                 }
                 emb_str = "[" + ",".join(str(v) for v in embedding) + "]"
-                cur.execute(
-                    f"""
-                    INSERT INTO {RAG_TABLE} (id, namespace, embedding, content, metadata)
-                    VALUES (%s, %s, %s::vector, %s, %s)
-                    """,
-                    (
-                        str(uuid.uuid4()),
-                        namespace,
-                        emb_str,
-                        text,
-                        json.dumps(meta),
-                    ),
-                )
-                total_upserted += 1
+                rows.append((str(uuid.uuid4()), namespace, emb_str, text, json.dumps(meta)))
+            if rows:
+                _insert_chunk_rows(cur, rows)
+                total_upserted += len(rows)
 
             conn.commit()
             logger.info(f"Ingested pre-computed batch {start}-{end} of {total_items}")
@@ -587,6 +862,7 @@ def ingest_precomputed_embeddings(
         cur.close()
         conn.commit()
         conn.close()
+        _invalidate_query_cache(namespace)
 
         return {
             "success": True,
@@ -623,97 +899,131 @@ def query_textbook(
     if not query or not query.strip():
         return {"success": True, "chunks": []}
 
-    conn = _get_pg_conn()
-    if not conn:
-        return {"success": False, "chunks": [], "error": _pgvector_not_available_message()}
+    namespace = _namespace_name(module_id)
+    query_text = query.strip()
+    limit = min(k, 10)
+    cache_key = (namespace, query_text, limit)
+    with _query_cache_lock:
+        cached = _query_cache.get(cache_key)
+    if cached is not None:
+        return {"success": True, "chunks": [dict(c) for c in cached]}
 
     openai_client = _get_openai_client()
     if not openai_client:
         return {"success": False, "chunks": [], "error": "Embeddings not available."}
 
-    namespace = _namespace_name(module_id)
-
-    try:
-        embeddings = _get_embeddings([query.strip()], openai_client)
-        if not embeddings:
-            return {"success": False, "chunks": [], "error": "Failed to generate query embedding."}
-        
-        # Pass as pgvector string literal — avoids importing numpy
-        query_emb_str = "[" + ",".join(str(v) for v in embeddings[0]) + "]"
-
-        cur = conn.cursor()
-        cur.execute(
-            f"""
-            SELECT content, metadata FROM {RAG_TABLE}
-            WHERE namespace = %s
-            ORDER BY embedding <=> %s::vector
-            LIMIT %s
-            """,
-            (namespace, query_emb_str, min(k, 10)),
-        )
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
-
-        chunks = []
-        for content, meta in rows:
-            if meta and isinstance(meta, dict):
-                m = dict(meta)
-            else:
-                m = json.loads(meta) if isinstance(meta, str) else {}
-            chunks.append({"content": content or "", "metadata": m})
+    with _pg_conn() as conn:
+        if not conn:
+            return {"success": False, "chunks": [], "error": _pgvector_not_available_message()}
 
-        return {"success": True, "chunks": chunks}
-    except Exception as e:
-        logger.warning("Error querying textbook for module %s: %s", module_id, e)
         try:
-            conn.close()
-        except Exception:
-            pass
-        return {"success": False, "chunks": [], "error": str(e)}
+            embedding = _get_query_embedding(query_text, openai_client)
+            if not embedding:
+                return {"success": False, "chunks": [], "error": "Failed to generate query embedding."}
+            
+            # Pass as an untyped pgvector literal — avoids importing numpy, and Postgres
+            # resolves it to the column's type (vector or halfvec) so the index is used
+            query_emb_str = "[" + ",".join(str(v) for v in embedding) + "]"
+
+            cur = conn.cursor()
+            if BINARY_QUANTIZED_SEARCH:
+                candidates = max(BINARY_SEARCH_CANDIDATES, limit)
+                # HNSW returns at most ef_search rows (default 40) before the namespace filter runs,
+                # so widen it for this transaction; iterative scans (pgvector >= 0.8) keep
+                # searching until enough rows pass the filter
+                cur.execute("SET LOCAL hnsw.ef_search = %s", (min(candidates, HNSW_MAX_EF_SEARCH),))
+                cur.execute("SAVEPOINT rag_iterative_scan")
+                try:
+                    cur.execute("SET LOCAL hnsw.iterative_scan = relaxed_order")
+                except Exception:
+                    cur.execute("ROLLBACK TO SAVEPOINT rag_iterative_scan")
+                # Coarse Hamming-distance candidates from the bit index, reranked by exact cosine
+                cur.execute(
+                    f"""
+                    SELECT content, metadata FROM (
+                        SELECT content, metadata, embedding FROM {RAG_TABLE}
+                        WHERE namespace = %s
+                        ORDER BY binary_quantize(embedding)::bit({EMBEDDING_DIMENSION})
+                            <~> binary_quantize(%s::vector)
+                        LIMIT %s
+                    ) candidates
+                    ORDER BY embedding <=> %s
+                    LIMIT %s
+                    """,
+                    (namespace, query_emb_str, candidates, query_emb_str, limit),
+                )
+            else:
+                cur.execute(
+                    f"""
+                    SELECT content, metadata FROM {RAG_TABLE}
+                    WHERE namespace = %s
+                    ORDER BY embedding <=> %s
+                    LIMIT %s
+                    """,
+                    (namespace, query_emb_str, limit),
+                )
+            rows = cur.fetchall()
+            cur.close()
+
+            chunks = []
+            for content, meta in rows:
+                if meta and isinstance(meta, dict):
+                    m = dict(meta)
+                else:
+                    m = json.loads(meta) if isinstance(meta, str) else {}
+                chunks.append({"content": content or "", "metadata": m})
+
+            with _query_cache_lock:
+                _query_cache[cache_key] = chunks
+            return {"success": True, "chunks": [dict(c) for c in chunks]}
+        except Exception as e:
+            logger.warning("Error querying textbook for module %s: %s", module_id, e)
+            return {"success": False, "chunks": [], "error": str(e)}
 
 
 def textbook_has_content(module_id: str) -> bool:
     """Return True if this module has a textbook ingested in the vector store."""
-    conn = _get_pg_conn()
-    if not conn:
-        return False
-    
     namespace = _namespace_name(module_id)
-    try:
-        cur = conn.cursor()
-        cur.execute(f"SELECT COUNT(*) FROM {RAG_TABLE} WHERE namespace = %s", (namespace,))
-        count = cur.fetchone()[0]
-        cur.close()
-        conn.close()
-        return count > 0
-    except Exception:
+    with _query_cache_lock:
+        cached = _has_content_cache.get(namespace)
+    if cached is not None:
+        return cached
+    
+    with _pg_conn() as conn:
+        if not conn:
+            return False
+        
         try:
-            conn.close()
+            cur = conn.cursor()
+            cur.execute(
+                f"SELECT EXISTS (SELECT 1 FROM {RAG_TABLE} WHERE namespace = %s)",
+                (namespace,),
+            )
+            has_content = bool(cur.fetchone()[0])
+            cur.close()
         except Exception:
-            pass
-        return False
+            return False
+    
+    with _query_cache_lock:
+        _has_content_cache[namespace] = has_content
+    return has_content
 
 
 def delete_textbook(module_id: str) -> Dict[str, Any]:
     """Remove textbook content for this module."""
-    conn = _get_pg_conn()
-    if not conn:
-        return {"success": False, "error": _pgvector_not_available_message()}
-    
     namespace = _namespace_name(module_id)
-    try:
-        cur = conn.cursor()
-        cur.execute(f"DELETE FROM {RAG_TABLE} WHERE namespace = %s", (namespace,))
-        cur.close()
-        conn.commit()
-        conn.close()
-        return {"success": True}
-    except Exception as e:
-        logger.warning("Error deleting textbook for module %s: %s", module_id, e)
-        conn.rollback()
+    with _pg_conn() as conn:
+        if not conn:
+            return {"success": False, "error": _pgvector_not_available_message()}
+        
         try:
-            conn.close()
-        except Exception:
-            pass
-        return {"success": False, "error": str(e)}
+            cur = conn.cursor()
+            cur.execute(f"DELETE FROM {RAG_TABLE} WHERE namespace = %s", (namespace,))
+            cur.close()
+            conn.commit()
+            _invalidate_query_cache(namespace)
+            return {"success": True}
+        except Exception as e:
+            logger.warning("Error deleting textbook for module %s: %s", module_id, e)
+            conn.rollback()
+            return {"success": False, "error": str(e)}